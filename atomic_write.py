@@ -0,0 +1,18 @@
+import os
+import threading
+
+
+def write_atomic(path, text):
+    """Write text to path through a temporary file and a rename, readers never see half a file."""
+    # unique per process and thread, concurrent writers of the same path each rename a whole file
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporary, 'w') as f:
+            f.write(text)
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
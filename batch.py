@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Run one valuation model over many tickers on a process pool.
+
+    python batch.py code.txt tickers.txt -o valuations.jsonl -j 8
+
+Every worker parses and translates the model once and keeps it warm for all the tickers
+it gets. Results are written as JSON Lines in completion order, one line per ticker:
+{"ticker", "value", "ccy", "error", "fetch_ms", "run_ms"}.
+
+With --prefetch the parent fetches the data for all tickers first, quote and profile are
+requested for up to FETCH_BATCH_SIZE tickers at once.
+
+Runs whose model, fetched data and inputs match an earlier run are answered from the result
+cache (RESULT_CACHE=0 turns it off, RESULT_CACHE_DIR shares it between processes).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from fetch_planner import BATCH_SIZE, fetch_jobs
+from final import async_api_get, build_context, execute_valuation, get_urls, parse_input_params
+from http_client import api_client
+from model_cache import model_cache
+from prelude import NATIVE_HELPERS, get_prelude
+from preprocessor import parse_model
+from response_cache import response_cache
+from result_cache import result_cache
+
+# per worker process state, set by init_worker
+_model = None
+_input_params = {}
+_keep_logs = False
+# one event loop per worker so the pooled connections of api_client outlive a ticker
+_loop = None
+
+
+def init_worker(raw_model, input_params, keep_logs=False, processes=1):
+    global _loop
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    # every worker fetches for itself, together they keep to the rate limits
+    api_client.share(processes)
+    load_model(raw_model, input_params, keep_logs)
+
+
+def load_model(raw_model, input_params, keep_logs=False):
+    """Set the model value_ticker runs, without an event loop (for threads that only get prefetched data)."""
+    global _model, _input_params, _keep_logs
+    _model = parse_model(raw_model)
+    _input_params = input_params
+    _keep_logs = keep_logs
+    # translate up front and let js2py load its builtins so the first ticker does not pay for it
+    model_cache.get(get_prelude(NATIVE_HELPERS) + _model.source + '\n_when_done();')
+    model_cache.execute(get_prelude(NATIVE_HELPERS), {})
+
+
+async def fetch(urls):
+    responses = await async_api_get(urls)
+    if response_cache is not None:
+        # finish the refreshes of stale responses before the loop is paused for the valuation
+        await response_cache.drain()
+    return responses
+
+
+def model_functions(model):
+    return [name + ''.join(arguments) for name, arguments in model.when_calls]
+
+
+def value_ticker(ticker, responses=None):
+    """Value one ticker, responses are fetched here unless the parent prefetched them."""
+    fetch_ms = None
+    if responses is None:
+        started = time.perf_counter()
+        try:
+            responses = _loop.run_until_complete(fetch(get_urls(model_functions(_model), ticker)))
+        except Exception as e:
+            return {'ticker': ticker, 'value': None, 'ccy': None, 'error': f"{type(e).__name__}: {e}",
+                    'fetch_ms': round((time.perf_counter() - started) * 1000, 3), 'run_ms': None}
+        fetch_ms = round((time.perf_counter() - started) * 1000, 3)
+    result = evaluate(_model, _input_params, ticker, responses, _keep_logs)
+    result['fetch_ms'] = fetch_ms
+    return result
+
+
+def evaluate(model, input_params, ticker, responses, keep_logs=False):
+    """Value ticker from fetched responses with any parsed model, for callers that serve several models."""
+    result = {'ticker': ticker, 'value': None, 'ccy': None, 'error': None, 'fetch_ms': None}
+    logs = io.StringIO()
+    started = time.perf_counter()
+    try:
+        key = cached = None
+        if result_cache is not None:
+            key = result_cache.key(model.source, responses, input_params)
+            cached = result_cache.get(key)
+        if cached is not None:
+            # same model, data and inputs as an earlier run
+            result['value'] = cached['value']
+            result['ccy'] = cached['ccy']
+            logs.write(cached['logs'])
+        else:
+            context = build_context(model.done_parameters, responses, dict(input_params))
+            # console.log of the model goes to stdout, keep it away from the results
+            with contextlib.redirect_stdout(logs):
+                scope = execute_valuation(model.source, context)
+            result['value'] = scope._return_value
+            result['ccy'] = scope._return_ccy
+            if key is not None:
+                result_cache.set(key, result['value'], result['ccy'], logs.getvalue())
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['run_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    if keep_logs:
+        result['logs'] = logs.getvalue()
+    return result
+
+
+def read_tickers(path):
+    f = sys.stdin if path == '-' else open(path, 'r')
+    with f:
+        return [line.strip().upper() for line in f if line.strip() and not line.startswith('#')]
+
+
+def prefetched(model, tickers, batch_size=BATCH_SIZE):
+    """Yield (ticker, responses) with the data fetched by the parent, batch_size tickers at a time."""
+    functions = model_functions(model)
+    loop = asyncio.new_event_loop()
+    try:
+        for start in range(0, len(tickers), batch_size):
+            chunk = tickers[start:start + batch_size]
+            try:
+                responses = loop.run_until_complete(fetch_jobs([(ticker, functions) for ticker in chunk], batch_size))
+            except Exception:
+                # let the workers fetch this chunk ticker by ticker, failures then stay per ticker
+                responses = [None] * len(chunk)
+            yield from zip(chunk, responses)
+        loop.run_until_complete(api_client.close())
+    finally:
+        loop.close()
+
+
+def run_batch(raw_model, tickers, output, workers=None, input_params=None, keep_logs=False, prefetch=False):
+    """
+    Value every ticker and write each result to output as soon as it is done.
+    With prefetch the parent fetches the data of all tickers with batched quote/profile requests
+    and the workers only run the model.
+    """
+    model = parse_model(raw_model)  # a broken model fails here instead of in every worker
+    workers = workers or os.cpu_count() or 1
+    # tickers submitted ahead of the workers, the next chunk is fetched while they run
+    window = 4 * workers
+    completed = 0
+    pending = set()
+
+    def write(futures):
+        nonlocal completed
+        for future in futures:
+            pending.discard(future)
+            output.write(json.dumps(future.result()) + '\n')
+            output.flush()
+            completed += 1
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(raw_model, input_params or {}, keep_logs, workers)) as executor:
+        jobs = prefetched(model, tickers) if prefetch else ((ticker, None) for ticker in tickers)
+        for ticker, responses in jobs:
+            # written before a chunk is fetched and whenever the window is full
+            write([future for future in pending if future.done()])
+            if len(pending) >= window:
+                write(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending.add(executor.submit(value_ticker, ticker, responses))
+        while pending:
+            write(wait(pending, return_when=FIRST_COMPLETED).done)
+    return completed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a valuation model across a list of tickers.")
+    parser.add_argument('model', help="valuation model file, e.g. code.txt")
+    parser.add_argument('tickers', help="file with one ticker per line, '-' for stdin")
+    parser.add_argument('-o', '--output', default='valuations.jsonl', help="JSON Lines output, '-' for stdout")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--input', default='', help="input parameters, e.g. '#MIN=51&MAX=52'")
+    parser.add_argument('--prefetch', action='store_true',
+                        help="fetch all data up front in the parent, batching quote/profile requests")
+    parser.add_argument('--logs', action='store_true', help="include the model console output in the results")
+    args = parser.parse_args()
+
+    with open(args.model, 'r') as f:
+        raw_model = f.read()
+    tickers = read_tickers(args.tickers)
+
+    started = time.perf_counter()
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    with output if output is not sys.stdout else contextlib.nullcontext():
+        completed = run_batch(raw_model, tickers, output, args.workers,
+                              parse_input_params(args.input), args.logs, args.prefetch)
+    elapsed = time.perf_counter() - started
+    print(f"{completed} valuations in {elapsed:.1f}s ({completed / elapsed:.1f}/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Bot detection per log line with the compiled, cached classifier of explore-logs/bot_classifier.py,
+compared with the previous is_bot_request that scanned its signature list on every call.
+
+    python benchmarks/bench_bot_classifier.py explore-logs/access.log
+
+cold builds a new classifier for every pass, so each distinct User-Agent is a cache miss once,
+warm reuses one and uncached scans the signatures on every line. regex is the alternative of
+one alternation of all signatures, without the cache.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'explore-logs'))
+
+from bot_classifier import BOT_SIGNATURES, BotClassifier  # noqa: E402
+from test_bot_requests import DummyRequest, extract_user_agent  # noqa: E402
+
+
+def legacy_is_bot_request(request):
+    # is_bot_request as it was before bot_classifier.py, kept for comparison only
+    user_agent_string = request.META.get("HTTP_USER_AGENT", "").lower().strip()
+    bot_keyword_signatures = [
+        "bot", "crawl", "spider", "slurp", "reader", "fetch",
+        "monitor", "analyzer", "healthcheck",
+        "python", "requests", "urllib", "java",
+        "okhttp", "curl", "wget", "libwww",
+        "httpclient", "go-http-client", "axios",
+        "got", "postman", "insomnia",
+        "headlesschrome", "phantomjs", "puppeteer",
+        "playwright", "selenium", "chromedp",
+        "lighthouse", "pagespeed",
+        "ahrefs", "semrush", "yandex",
+        "openai", "chatgpt", "oai-search", "perplexity",
+        "googleother", "google-read-aloud",
+        "facebookexternalhit", "embedly", "whatsapp",
+        "pingdom", "statuscake",
+        "support", "feed", "spreadsheet", "script", "about",
+    ]
+    if not user_agent_string or user_agent_string == "-":
+        return True
+    for bot_signature in bot_keyword_signatures:
+        if bot_signature in user_agent_string:
+            return True
+    return False
+
+
+def measure(function, min_time=0.5):
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        function()
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return elapsed / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot classifier against the previous is_bot_request.")
+    parser.add_argument('log_file', nargs='?', default=os.path.join(ROOT, 'explore-logs', 'access.log'))
+    parser.add_argument('--min-time', type=float, default=0.5, help="seconds spent on each measurement")
+    args = parser.parse_args()
+
+    with open(args.log_file, encoding='utf-8', errors='replace') as f:
+        user_agents = [extract_user_agent(line) for line in f]
+    requests = [DummyRequest(user_agent) for user_agent in user_agents]
+
+    classifier = BotClassifier()
+    differences = sum(legacy_is_bot_request(request) != classifier.is_bot(request.META['HTTP_USER_AGENT'])
+                      for request in requests)
+    if differences:
+        raise SystemExit(f"{differences} requests classified differently")
+
+    def legacy():
+        for request in requests:
+            legacy_is_bot_request(request)
+
+    def cold():
+        is_bot = BotClassifier().is_bot
+        for user_agent in user_agents:
+            is_bot(user_agent)
+
+    def warm():
+        for user_agent in user_agents:
+            classifier.is_bot(user_agent)
+
+    def uncached():
+        for user_agent in user_agents:
+            classifier._classify(user_agent)
+
+    pattern = re.compile('|'.join(map(re.escape, BOT_SIGNATURES)))
+
+    def regex():
+        for user_agent in user_agents:
+            user_agent = user_agent.lower().strip()
+            user_agent in ('', '-') or pattern.search(user_agent)
+
+    print(f"{len(user_agents)} lines, {len(set(user_agents))} distinct User-Agents, same verdicts")
+    print(f"{'variant':>10} {'ms/pass':>9} {'µs/line':>8} {'speedup':>8}")
+    baseline = None
+    for name, function in (('legacy', legacy), ('regex', regex), ('uncached', uncached), ('cold', cold), ('warm', warm)):
+        seconds = measure(function, args.min_time)
+        baseline = baseline or seconds
+        print(f"{name:>10} {seconds * 1000:>9.2f} {seconds / len(user_agents) * 1e6:>8.3f} "
+              f"{baseline / seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
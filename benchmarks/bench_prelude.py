@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Measures the speedup of the native prelude helpers over their JS versions, on the cases
+tests/test_prelude.py checks for identical results.
+
+    python benchmarks/bench_prelude.py --calls 200
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+from model_cache import ModelCache  # noqa: E402
+from prelude import get_prelude, install_native_helpers  # noqa: E402
+from test_prelude import CASES, make_context  # noqa: E402
+
+
+def run(cache, native, source, years):
+    context = make_context(years)
+    if native:
+        install_native_helpers(context)
+    return cache.execute(get_prelude(native) + source, context)
+
+
+def measure(cache, native, expression, years, calls, repeat=5):
+    source = 'for(var _k = 0; _k < ' + str(calls) + '; _k++){' + expression + ';}'
+    run(cache, native, source, years)  # translate outside of the measurement
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(cache, native, source, years)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / calls
+
+
+def measure_call(cache, native, expression, years, calls):
+    # building the scope is the same for both versions, only the calls are compared
+    overhead = measure(cache, native, '0', years, calls)
+    return measure(cache, native, expression, years, calls) - overhead
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare native and JS prelude helpers.")
+    parser.add_argument('--years', type=int, default=20, help="rows in each synthetic statement")
+    parser.add_argument('--calls', type=int, default=200, help="calls of each helper per measurement")
+    args = parser.parse_args()
+
+    cache = ModelCache()
+    print(f"{'helper':>28} {'js ms':>8} {'native ms':>10} {'speedup':>8}")
+    measured = set()
+    for helper, expression in CASES:
+        if helper in measured:
+            continue
+        measured.add(helper)
+        js_time = measure_call(cache, False, expression, args.years, args.calls)
+        native_time = measure_call(cache, True, expression, args.years, args.calls)
+        print(f"{helper:>28} {js_time * 1000:>8.3f} {native_time * 1000:>10.3f} {js_time / native_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Throughput of the model preprocessor on code.txt and on synthetic models made by
+repeating the helper functions of code.txt, compared with the previous string slicing.
+
+The preprocessor is slower than the string slicing and grows linearly with the model: it
+tokenizes all of it, the slicing skipped everything before $.when. A model is parsed once
+per process (parse_model keeps the results), so this is paid once and not per valuation.
+
+    python benchmarks/bench_preprocessor.py --sizes 1 10 100
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the parse itself, parse_model would answer repeated sources from its cache
+from preprocessor import _parse_model  # noqa: E402
+
+
+def legacy_format_raw_valuation(valuation):
+    # format_raw_valuation as it was before preprocessor.py, kept for comparison only
+    index_start = valuation.find(start := '$.when(')
+    index_end = index_start + len(start) + valuation[index_start:].find('{') - 1
+    brackets = 1
+    for i in range(index_end, len(valuation)):
+        if valuation[i] == '{':
+            brackets += 1
+        if valuation[i] == '}':
+            brackets -= 1
+        if valuation[i] == ')' and brackets == 0:
+            for j in range(i, len(valuation)):
+                if valuation[j] == ';':
+                    valuation = valuation[:i] + valuation[j + 1:]
+                    break
+            break
+    if len(valuation) > index_end and index_start <= index_end - 1:
+        valuation = valuation[0:index_start] + 'function _when_done(){' + valuation[index_end - 1:]
+    valuation = re.sub(r"`(.*?)`", "", valuation, flags=re.DOTALL)
+    index_start = valuation.find(start := 'Description(') + len(start)
+    if index_start:
+        parenthesis = 1
+        for i in range(index_start, len(valuation)):
+            if valuation[i] == '(':
+                parenthesis += 1
+            elif valuation[i] == ')':
+                parenthesis -= 1
+            if valuation[i] == ')' and parenthesis == 0:
+                valuation = valuation[0:index_start] + "''" + valuation[i:]
+                break
+    return valuation
+
+
+def synthetic_model(raw_model, copies):
+    """code.txt with its helper functions (everything before $.when) repeated copies times."""
+    split_at = raw_model.index('// If we are calculating the value per share')
+    helpers, rest = raw_model[:split_at], raw_model[split_at:]
+    return helpers * copies + rest
+
+
+def measure(function, source, min_time=0.5):
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        function(source)
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return elapsed / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the valuation model preprocessor.")
+    parser.add_argument('model', nargs='?', default=os.path.join(ROOT, 'code.txt'))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1, 10, 100],
+                        help="how many times the model helpers are repeated")
+    parser.add_argument('--min-time', type=float, default=0.5, help="seconds spent on each measurement")
+    args = parser.parse_args()
+
+    with open(args.model, 'r') as f:
+        raw_model = f.read()
+
+    print(f"{'model':>12} {'size KiB':>9} {'legacy ms':>10} {'parse ms':>9} {'MiB/s':>7}")
+    for copies in args.sizes:
+        source = synthetic_model(raw_model, copies)
+        legacy = measure(legacy_format_raw_valuation, source, args.min_time)
+        current = measure(_parse_model, source, args.min_time)
+        print(f"{'x' + str(copies):>12} {len(source) / 1024:>9.1f} {legacy * 1000:>10.2f} "
+              f"{current * 1000:>9.2f} {len(source) / current / 2 ** 20:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Compares the cost of a run and of the vectorized helpers with the copy-on-write report views
+(over the fetched lists or over columnar statements) and with a full conversion, and the peak
+memory a run allocates on top of the shared responses. tests/test_reports.py checks that models
+see the same data through all of them.
+
+    python benchmarks/bench_reports.py --years 80
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+from fixtures import valuation_context  # noqa: E402
+from model_cache import ModelCache  # noqa: E402
+from preprocessor import parse_model  # noqa: E402
+from statements import decode_statement  # noqa: E402
+from test_prelude import make_context  # noqa: E402
+from test_reports import MODES, run  # noqa: E402
+
+def measure(cache, source, context, mode, repeat):
+    if mode == 'columns':
+        # statements are decoded once when fetched, not per run
+        context = {name: decode_statement(value) for name, value in context.items()}
+        mode = 'view'
+    run(cache, True, source, context, mode)  # translate outside of the measurement
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(cache, True, source, context, mode)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(cache, source, context, mode):
+    if mode == 'columns':
+        context = {name: decode_statement(value) for name, value in context.items()}
+        mode = 'view'
+    run(cache, True, source, context, mode)
+    tracemalloc.start()
+    try:
+        run(cache, True, source, context, mode)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare copy-on-write report views with a full conversion.")
+    parser.add_argument('--years', type=int, default=20, help="rows in each synthetic statement")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--calls', type=int, default=100, help="calls of each helper per measurement")
+    args = parser.parse_args()
+
+    cache = ModelCache()
+    with open(os.path.join(ROOT, 'code.txt'), 'r') as f:
+        model = parse_model(f.read())
+    context = valuation_context(years=args.years)
+    cases = [
+        ('scope only', context, ''),
+        ('code.txt', context, model.source + '\n_when_done();'),
+    ]
+    helpers = ["averageMargin('netIncome', 'revenue', income)", "averageGrowthRate('revenue', income)",
+               "linearRegressionGrowthRate('revenue', income, 5, 1)"]
+    for expression in helpers:
+        source = 'for(var _k = 0; _k < ' + str(args.calls) + '; _k++){' + expression + ';}'
+        cases.append((expression.split('(')[0], make_context(args.years), source))
+
+    print(f"\n{'run':>26} " + ' '.join(f"{mode + ' ms':>13}" for mode in MODES))
+    for name, context, source in cases:
+        # console.log of the model would dominate the timings
+        with contextlib.redirect_stdout(io.StringIO()):
+            times = [measure(cache, source, context, mode, args.repeat) for mode in MODES]
+        print(f"{name:>26} " + ' '.join(f"{elapsed * 1000:>13.2f}" for elapsed in times))
+
+    print(f"\n{'peak memory':>26} " + ' '.join(f"{mode + ' KiB':>13}" for mode in MODES))
+    for name, context, source in cases[:2]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            peaks = [peak_memory(cache, source, context, mode) for mode in MODES]
+        print(f"{name:>26} " + ' '.join(f"{peak / 1024:>13.0f}" for peak in peaks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Compare two result files of benchmarks/suite.py and fail on regressions.
+
+    python benchmarks/compare.py benchmarks/baseline.json results.json --threshold 0.15
+
+A benchmark regressed when it got worse (slower, or less throughput) by more than threshold,
+relative to the baseline. The exit status is 1 when any did.
+"""
+
+import argparse
+import json
+import sys
+
+
+def compare(baseline, current, threshold=0.10):
+    """[(name, old, new, change, status)], change is positive when the benchmark got worse."""
+    rows = []
+    old_results = baseline['results']
+    new_results = current['results']
+    for name in sorted(set(old_results) | set(new_results)):
+        old = old_results.get(name)
+        new = new_results.get(name)
+        if old is None or new is None:
+            rows.append((name, old and old['value'], new and new['value'], None, 'new' if old is None else 'missing'))
+            continue
+        if old['value'] == 0:
+            change = 0.0
+        elif new.get('better', 'lower') == 'lower':
+            change = new['value'] / old['value'] - 1
+        else:
+            change = old['value'] / new['value'] - 1 if new['value'] else float('inf')
+        if change > threshold:
+            status = 'REGRESSION'
+        elif change < -threshold:
+            status = 'improved'
+        else:
+            status = 'ok'
+        rows.append((name, old['value'], new['value'], change, status))
+    return rows
+
+
+def print_comparison(rows, units, output=sys.stdout):
+    print(f"{'benchmark':>34} {'baseline':>12} {'current':>12} {'unit':>10} {'worse by':>9}  status", file=output)
+    for name, old, new, change, status in rows:
+        old_text = '-' if old is None else f"{old:.3f}"
+        new_text = '-' if new is None else f"{new:.3f}"
+        change_text = '' if change is None else f"{change:+.1%}"
+        print(f"{name:>34} {old_text:>12} {new_text:>12} {units.get(name, ''):>10} {change_text:>9}  {status}",
+              file=output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results with a baseline.")
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r') as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    units = {name: result['unit'] for name, result in dict(baseline['results'], **current['results']).items()}
+    print_comparison(rows, units)
+    sys.exit(1 if any(status == 'REGRESSION' for *_, status in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
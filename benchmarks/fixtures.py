@@ -0,0 +1,75 @@
+"""Synthetic FMP-shaped financial statements used by the benchmarks."""
+
+import datetime
+import random
+
+INCOME_KEYS = [
+    'revenue', 'costOfRevenue', 'grossProfit', 'researchAndDevelopmentExpenses',
+    'sellingGeneralAndAdministrativeExpenses', 'operatingExpenses', 'operatingIncome',
+    'interestExpense', 'incomeBeforeTax', 'incomeTaxExpense', 'netIncome', 'eps',
+    'weightedAverageShsOut', 'weightedAverageShsOutDil',
+]
+BALANCE_KEYS = [
+    'cashAndCashEquivalents', 'totalCurrentAssets', 'totalAssets', 'totalCurrentLiabilities',
+    'totalDebt', 'totalLiabilities', 'totalStockholdersEquity', 'netDebt',
+]
+CASH_FLOW_KEYS = [
+    'netIncome', 'depreciationAndAmortization', 'stockBasedCompensation',
+    'netCashProvidedByOperatingActivities', 'capitalExpenditure', 'freeCashFlow', 'dividendsPaid',
+]
+
+
+def statement(keys, ticker='AAPL', years=20, quarterly=False, seed=0):
+    """Newest first list of report dicts, the way FMP returns them."""
+    rng = random.Random(f"{ticker}-{seed}")
+    periods = years * 4 if quarterly else years
+    step = 91 if quarterly else 365
+    last = datetime.date(2024, 9, 28)
+    rows = []
+    for i in range(periods):
+        date = last - datetime.timedelta(days=step * i)
+        row = {
+            'date': date.isoformat(),
+            'symbol': ticker,
+            'reportedCurrency': 'USD',
+            'calendarYear': str(date.year),
+            'period': f"Q{(date.month - 1) // 3 + 1}" if quarterly else 'FY',
+        }
+        for key in keys:
+            row[key] = round(rng.uniform(-1e9, 1e11), 0)
+        rows.append(row)
+    return rows
+
+
+def quote(ticker='AAPL'):
+    rng = random.Random(ticker)
+    return [{'symbol': ticker, 'price': round(rng.uniform(5, 500), 2), 'marketCap': rng.uniform(1e9, 3e12),
+             'sharesOutstanding': rng.uniform(1e7, 1.6e10), 'exchange': 'NASDAQ'}]
+
+
+def profile(ticker='AAPL'):
+    rng = random.Random(ticker)
+    return [{'symbol': ticker, 'price': round(rng.uniform(5, 500), 2), 'beta': rng.uniform(0.3, 2),
+             'currency': 'USD', 'companyName': ticker + ' Inc.', 'country': 'US'}]
+
+
+def treasury(days=30):
+    rng = random.Random(days)
+    today = datetime.date(2024, 9, 30)
+    return [{'date': (today - datetime.timedelta(days=i)).isoformat(), 'month1': rng.uniform(4, 5),
+             'year1': rng.uniform(3.5, 4.5), 'year10': rng.uniform(3.5, 4.5), 'year30': rng.uniform(3.8, 4.8)}
+            for i in range(days)]
+
+
+def valuation_context(ticker='AAPL', years=20):
+    """Context for code.txt: every $.when response wrapped in a list like final.py does."""
+    income = statement(INCOME_KEYS, ticker, years)
+    flows = statement(CASH_FLOW_KEYS, ticker, years, seed=1)
+    return {
+        'income': [income],
+        'income_ltm': [dict(income[0], date='LTM')],
+        'balance': [statement(BALANCE_KEYS, ticker, years, seed=2)],
+        'flows': [flows],
+        'flows_ltm': [dict(flows[0], date='LTM')],
+        '_input_params': {},
+    }
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the FMP and discountingcashflows APIs, serving the synthetic data of
+fixtures.py with an optional latency per request.
+
+    python benchmarks/stub_server.py --port 8765 --latency 0.05
+    FMP_API=http://127.0.0.1:8765/api DCF_API=http://127.0.0.1:8765/dcf python batch.py ...
+
+The data depends on the ticker only, so repeated runs see the same responses.
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import fixtures
+
+_TICKERS = re.compile(r'/([A-Za-z0-9.\-^,]+)/?$')
+
+
+def response(path, years=20):
+    """Body for an API path the way get_urls builds it."""
+    parts = urlsplit(path)
+    match = _TICKERS.search(parts.path)
+    tickers = match.group(1).upper().split(',') if match else []
+    ticker = tickers[0] if tickers else 'AAPL'
+    quarterly = parse_qs(parts.query).get('period') == ['quarter']
+    if '/ltm/' in parts.path:
+        keys = fixtures.CASH_FLOW_KEYS if 'cash-flow' in parts.path else fixtures.INCOME_KEYS
+        return dict(fixtures.statement(keys, ticker, 1)[0], date='LTM')
+    if 'income-statement' in parts.path:
+        return fixtures.statement(fixtures.INCOME_KEYS, ticker, years, quarterly)
+    if 'balance-sheet-statement' in parts.path:
+        return fixtures.statement(fixtures.BALANCE_KEYS, ticker, years, quarterly, seed=2)
+    if 'cash-flow-statement' in parts.path:
+        return fixtures.statement(fixtures.CASH_FLOW_KEYS, ticker, years, quarterly, seed=1)
+    if '/quote/' in parts.path:
+        return [row for ticker in tickers for row in fixtures.quote(ticker)]
+    if '/profile/' in parts.path:
+        return [row for ticker in tickers for row in fixtures.profile(ticker)]
+    if 'treasury' in parts.path:
+        return fixtures.treasury()
+    return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _encoded(path, years):
+    # generating the statements would otherwise be most of the work of a request
+    body = response(path, years)
+    return 404 if body is None else 200, json.dumps(body).encode('utf-8')
+
+
+class _Server(ThreadingHTTPServer):
+    # the default backlog of 5 makes concurrent clients wait for SYN retries
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class StubServer:
+    """
+    Stub API in a background thread, or with start(process=True) in a forked process that does
+    not compete with the measured code for the GIL. Port 0 picks a free port. The statuses in
+    `errors` answer the next requests, one each, before the data is served again.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, years=20):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                with server._lock:
+                    error = server.errors.pop(0) if server.errors else None
+                    server.requests += 1
+                if error is None:
+                    status, data = _encoded(self.path, server.years)
+                else:
+                    status, data = error, b'{"Error Message": "stub error"}'
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.latency = latency
+        self.years = years
+        self.requests = 0
+        self.errors = []
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), Handler)
+        self._thread = None
+        self._process = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self, process=False):
+        if process:
+            self._process = multiprocessing.get_context('fork').Process(target=self.serve_forever, daemon=True)
+            self._process.start()
+        else:
+            self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+        else:
+            self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic FMP-shaped responses.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--years', type=int, default=20, help="rows in the annual statements")
+    args = parser.parse_args()
+
+    server = StubServer(args.host, args.port, args.latency, args.years)
+    print(f"serving on {server.url}, FMP_API={server.url}/api DCF_API={server.url}/dcf")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Reproducible performance numbers of the valuation pipeline, measured against the local stub
+API of stub_server.py: preprocessing, translation, execution, fetch fan-out and end-to-end
+latency and throughput of a batch.
+
+    python benchmarks/suite.py -o results.json --baseline benchmarks/baseline.json
+    python benchmarks/suite.py --only preprocess execute
+
+Results are written as JSON ({"meta", "results": {name: {"value", "unit", "better"}}}), with
+--baseline they are compared by compare.py and the exit status is 1 on a regression.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import importlib.metadata
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_preprocessor import synthetic_model  # noqa: E402
+from compare import compare, print_comparison  # noqa: E402
+from stub_server import StubServer  # noqa: E402
+
+GROUPS = ('preprocess', 'translate', 'execute', 'fetch', 'end_to_end')
+
+
+def best_of(function, repeat=5, min_time=0.2):
+    """Fastest mean time of function over repeat rounds of at least min_time seconds, in ms."""
+    best = None
+    for _ in range(repeat):
+        runs = 0
+        started = time.perf_counter()
+        while True:
+            function()
+            runs += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        mean = elapsed / runs
+        best = mean if best is None else min(best, mean)
+    return best * 1000
+
+
+def result(value, unit='ms', better='lower'):
+    return {'value': round(value, 4), 'unit': unit, 'better': better}
+
+
+def bench_preprocess(raw_model, args):
+    # uncached, parse_model answers a repeated source from its cache
+    from preprocessor import _parse_model
+    large = synthetic_model(raw_model, 100)
+    return {
+        'preprocess.code_txt': result(best_of(lambda: _parse_model(raw_model))),
+        'preprocess.synthetic_x100': result(best_of(lambda: _parse_model(large), repeat=3)),
+    }
+
+
+def bench_translate(raw_model, args):
+    from model_cache import ModelCache
+    from prelude import get_prelude
+    from preprocessor import parse_model
+    source = get_prelude() + parse_model(raw_model).source + '\n_when_done();'
+    # a new cache every time, the translation is what is measured
+    return {'translate.code_txt': result(best_of(lambda: ModelCache().get(source), repeat=3, min_time=0))}
+
+
+def bench_execute(raw_model, args):
+    from final import build_context, execute_valuation
+    from fixtures import valuation_context
+    from preprocessor import parse_model
+    from statements import decode_statement
+    model = parse_model(raw_model)
+    raw_context = valuation_context(years=args.years)
+    responses = [decode_statement(raw_context[name][0]) for name in model.done_parameters]
+
+    def run():
+        context = build_context(model.done_parameters, responses, {})
+        with contextlib.redirect_stdout(io.StringIO()):
+            execute_valuation(model.source, context)
+
+    run()  # translate outside of the measurement
+    return {'execute.code_txt': result(best_of(run))}
+
+
+def bench_fetch(raw_model, args):
+    from final import async_api_get, get_urls
+    from http_client import api_client
+    from preprocessor import parse_model
+    functions = [name + ''.join(arguments) for name, arguments in parse_model(raw_model).when_calls]
+
+    async def fan_out(tickers):
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*[async_api_get(get_urls(functions, ticker)) for ticker in tickers])
+            return time.perf_counter() - started
+        finally:
+            await api_client.close()
+
+    tickers = [f"F{i:03d}" for i in range(args.tickers)]
+    one = min(asyncio.run(fan_out([ticker])) for ticker in tickers[:5])
+    many = asyncio.run(fan_out(tickers))
+    return {
+        'fetch.one_ticker': result(one * 1000),
+        'fetch.fan_out': result(len(tickers) / many, 'tickers/s', 'higher'),
+    }
+
+
+def bench_end_to_end(raw_model, args):
+    from http_client import api_client
+    from pipeline import valuations
+
+    async def run(tickers):
+        rows = []
+        try:
+            started = time.perf_counter()
+            async for row in valuations(raw_model, tickers, workers=args.workers):
+                rows.append(row)
+            return rows, time.perf_counter() - started
+        finally:
+            await api_client.close()
+
+    rows, elapsed = asyncio.run(run([f"E{i:03d}" for i in range(args.tickers)]))
+    errors = [row['error'] for row in rows if row['error']]
+    if errors:
+        raise RuntimeError(f"{len(errors)} valuations failed, first: {errors[0]}")
+    return {
+        'end_to_end.ticker_latency_p50': result(statistics.median(row['fetch_ms'] + row['run_ms'] for row in rows)),
+        'end_to_end.throughput': result(len(rows) / elapsed, 'tickers/s', 'higher'),
+    }
+
+
+def metadata(args):
+    try:
+        js2py_version = importlib.metadata.version('js2py')
+    except importlib.metadata.PackageNotFoundError:
+        js2py_version = ''
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'js2py': js2py_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'latency': args.latency,
+        'tickers': args.tickers,
+        'years': args.years,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the valuation benchmarks against a local stub API.")
+    parser.add_argument('model', nargs='?', default=os.path.join(ROOT, 'code.txt'))
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="results to compare with, exit status 1 on a regression")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed relative slowdown")
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=GROUPS)
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds the stub adds to every response")
+    parser.add_argument('--tickers', type=int, default=40, help="tickers of the fetch and end-to-end runs")
+    parser.add_argument('--years', type=int, default=20, help="rows in the annual statements")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="executor workers end to end")
+    args = parser.parse_args()
+
+    with open(args.model, 'r') as f:
+        raw_model = f.read()
+
+    server = StubServer(latency=args.latency, years=args.years).start(process=True)
+    try:
+        # set before the pipeline modules are imported, they read the settings once
+        os.environ.update({'FMP_API': server.url + '/api', 'DCF_API': server.url + '/dcf',
+                           'FMP_RATE_LIMIT': '1000000', 'RESULT_CACHE': '0', 'VALUATION_PROFILE': '0'})
+        os.environ.pop('RESPONSE_CACHE_DIR', None)
+        results = {}
+        for group in args.only:
+            started = time.perf_counter()
+            results.update(globals()['bench_' + group](raw_model, args))
+            print(f"{group} done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    finally:
+        server.stop()
+
+    current = {'meta': metadata(args), 'results': results}
+    for name, value in results.items():
+        print(f"{name:>34} {value['value']:>12.3f} {value['unit']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+            f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        rows = compare(baseline, current, args.threshold)
+        units = {name: value['unit'] for name, value in dict(baseline['results'], **results).items()}
+        print()
+        print_comparison(rows, units)
+        sys.exit(1 if any(status == 'REGRESSION' for *_, status in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
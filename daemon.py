@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Long running valuation service on a Unix socket, so a job does not pay for importing js2py and
+aiohttp and translating the prelude and the model every time it starts.
+
+    python daemon.py serve -j 4 --preload code.txt &
+    python daemon.py run code.txt tickers.txt -o valuations.jsonl --input '#MIN=51&MAX=52'
+    python daemon.py stats
+    python daemon.py stop
+
+run takes the arguments of pipeline.py and prints the same JSON Lines, it only imports the
+standard library. The socket is VALUATION_SOCKET or --socket. The daemon warms the prelude and
+the --preload models before it forks its workers, so they start with the translations.
+
+Protocol: one JSON request line, {"op": "value", "model", "tickers", "input", "logs"}, answered
+by one JSON line per result and a last line {"done": true, "count"} or {"error": "..."}.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+
+SOCKET_PATH = os.environ.get('VALUATION_SOCKET', '/tmp/valuation-js2py.sock')
+
+
+class DaemonUnavailable(ConnectionError):
+    pass
+
+
+# parsed models of a worker, by raw model
+_models = {}
+_MAX_MODELS = 32
+
+
+def _parsed(raw_model):
+    from preprocessor import parse_model
+    model = _models.pop(raw_model, None)
+    if model is None:
+        model = parse_model(raw_model)
+    _models[raw_model] = model
+    while len(_models) > _MAX_MODELS:
+        del _models[next(iter(_models))]
+    return model
+
+
+def _run(raw_model, input_params, keep_logs, ticker, responses):
+    # runs on the executor, a job carries its model so one pool serves every model
+    from batch import evaluate
+    result = evaluate(_parsed(raw_model), input_params, ticker, responses, keep_logs)
+    # the caches live in the workers, their counters travel back with the results
+    result['_worker'] = _counters()
+    return result
+
+
+def _counters():
+    from model_cache import model_cache
+    from result_cache import result_cache
+    counters = {'pid': os.getpid(),
+                'model_cache': {'size': len(model_cache), 'hits': model_cache.hits, 'misses': model_cache.misses}}
+    if result_cache is not None:
+        counters['result_cache'] = {'size': len(result_cache), 'hits': result_cache.hits,
+                                    'misses': result_cache.misses}
+    return counters
+
+
+def _ready(_):
+    return os.getpid()
+
+
+class ValuationDaemon:
+
+    def __init__(self, path=SOCKET_PATH, workers=None, executor='process', fetchers=8, queue_size=16, preload=()):
+        # the imports a job would otherwise pay for
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        import multiprocessing
+
+        from model_cache import model_cache
+        from prelude import NATIVE_HELPERS, get_prelude
+
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.fetchers = fetchers
+        self.queue_size = queue_size
+        self.started = time.time()
+        self.jobs = 0
+        self.tickers = 0
+        self._server = None
+        # latest cache counters of every worker, by pid
+        self._workers = {}
+
+        model_cache.execute(get_prelude(NATIVE_HELPERS), {})
+        for raw_model in preload:
+            model = _parsed(raw_model)
+            model_cache.get(get_prelude(NATIVE_HELPERS) + model.source + '\n_when_done();')
+        if executor == 'process':
+            # forked after the warm up, the workers inherit the translated code
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+            list(self.executor.map(_ready, range(self.workers)))
+        else:
+            self.executor = ThreadPoolExecutor(self.workers)
+
+    def stats(self):
+        """Counters of the daemon, the cache counters summed over the workers that ran a job."""
+        stats = {'pid': os.getpid(), 'uptime': round(time.time() - self.started, 1), 'workers': self.workers,
+                 'jobs': self.jobs, 'tickers': self.tickers}
+        for cache in ('model_cache', 'result_cache'):
+            counters = [worker[cache] for worker in self._workers.values() if cache in worker]
+            if counters:
+                stats[cache] = {name: sum(counter[name] for counter in counters) for name in ('size', 'hits', 'misses')}
+        return stats
+
+    async def handle(self, reader, writer):
+        import contextlib
+        import functools
+
+        from final import parse_input_params
+        from pipeline import valuations
+
+        def send(message):
+            writer.write(json.dumps(message).encode('utf-8') + b'\n')
+
+        try:
+            request = json.loads(await reader.readline())
+            op = request.get('op', 'value')
+            if op == 'stats':
+                send(self.stats())
+            elif op == 'stop':
+                send({'done': True})
+                self._server.close()
+            elif op == 'value':
+                input_params = parse_input_params(request.get('input', ''))
+                keep_logs = bool(request.get('logs'))
+                run = functools.partial(_run, request['model'], input_params, keep_logs)
+                count = 0
+                results = valuations(request['model'], request['tickers'], executor=self.executor,
+                                     workers=self.workers, fetchers=self.fetchers, queue_size=self.queue_size, run=run)
+                # closed right away when the client goes, its queued tickers are dropped
+                async with contextlib.aclosing(results):
+                    async for result in results:
+                        worker = result.pop('_worker', None)
+                        if worker is not None:
+                            self._workers[worker['pid']] = worker
+                        send(result)
+                        # a slow client holds back its own job, not the daemon
+                        await writer.drain()
+                        count += 1
+                self.jobs += 1
+                self.tickers += count
+                send({'done': True, 'count': count})
+            else:
+                send({'error': f"unknown op {op!r}"})
+        except (ConnectionError, BrokenPipeError):
+            return
+        except Exception as e:
+            send({'error': f"{type(e).__name__}: {e}"})
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def serve(self):
+        import asyncio
+        import signal
+
+        from http_client import api_client
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = await asyncio.start_unix_server(self.handle, self.path, limit=2 ** 24)
+        os.chmod(self.path, 0o600)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self._server.close)
+        print(f"valuation daemon {os.getpid()} on {self.path} with {self.workers} workers", file=sys.stderr)
+        try:
+            await self._server.wait_closed()
+        finally:
+            await api_client.close()
+            self.executor.shutdown(cancel_futures=True)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def request(message, path=SOCKET_PATH):
+    """Send a request to the daemon and yield its answer lines."""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        connection.close()
+        raise DaemonUnavailable(f"no valuation daemon on {path} ({e.strerror})") from e
+    with connection, connection.makefile('rb') as answers:
+        connection.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        for line in answers:
+            yield json.loads(line)
+
+
+def run_client(args):
+    with open(args.model, 'r') as f:
+        raw_model = f.read()
+    f = sys.stdin if args.tickers == '-' else open(args.tickers, 'r')
+    with f:
+        tickers = [line.strip().upper() for line in f if line.strip() and not line.startswith('#')]
+
+    started = time.perf_counter()
+    completed = 0
+    message = {'op': 'value', 'model': raw_model, 'tickers': tickers, 'input': args.input, 'logs': args.logs}
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for answer in request(message, args.socket):
+            if 'error' in answer and 'ticker' not in answer:
+                print(f"daemon: {answer['error']}", file=sys.stderr)
+                return 1
+            if answer.get('done'):
+                break
+            output.write(json.dumps(answer) + '\n')
+            completed += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - started
+    print(f"{completed} valuations in {elapsed:.1f}s ({completed / elapsed:.1f}/s)", file=sys.stderr)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-warmed valuation daemon and its client.")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="Unix socket of the daemon")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help="start the daemon in the foreground")
+    serve.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="executor workers")
+    serve.add_argument('--executor', choices=('process', 'thread'), default='process')
+    serve.add_argument('--fetchers', type=int, default=8, help="tickers fetched at the same time per job")
+    serve.add_argument('--queue-size', type=int, default=16, help="fetched tickers waiting for the executor")
+    serve.add_argument('--preload', nargs='*', default=[], help="model files to translate before serving")
+
+    run = commands.add_parser('run', help="value tickers on the daemon, arguments of pipeline.py")
+    run.add_argument('model', help="valuation model file, e.g. code.txt")
+    run.add_argument('tickers', help="file with one ticker per line, '-' for stdin")
+    run.add_argument('-o', '--output', default='valuations.jsonl', help="JSON Lines output, '-' for stdout")
+    run.add_argument('--input', default='', help="input parameters, e.g. '#MIN=51&MAX=52'")
+    run.add_argument('--logs', action='store_true', help="include the model console output in the results")
+
+    commands.add_parser('stats', help="print the counters of the daemon")
+    commands.add_parser('stop', help="stop the daemon")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'serve':
+            import asyncio
+            preload = []
+            for path in args.preload:
+                with open(path, 'r') as f:
+                    preload.append(f.read())
+            daemon = ValuationDaemon(args.socket, args.workers, args.executor, args.fetchers, args.queue_size, preload)
+            asyncio.run(daemon.serve())
+        elif args.command == 'run':
+            sys.exit(run_client(args))
+        else:
+            for answer in request({'op': args.command}, args.socket):
+                print(json.dumps(answer, indent=2))
+    except DaemonUnavailable as e:
+        print(f"{e}, start one with: python daemon.py serve", file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+bot_classifier.py
+-----------------
+User-Agent based bot detection with the signatures of is_bot_request built once, and the
+verdicts of recent User-Agent strings kept in an LRU cache.
+
+    from bot_classifier import bot_classifier, is_bot_request
+    bot_classifier.classify('python-requests/2.32')  # 'python'
+    bot_classifier.classify('Mozilla/5.0 (Windows NT 10.0) ...')  # None
+
+Traffic has few distinct User-Agents, so most requests are a dictionary lookup. A miss scans
+the signatures with `in`, on CPython that is several times faster than one alternation regex
+of all of them (see benchmarks/bench_bot_classifier.py).
+"""
+
+import functools
+from typing import Iterable, Optional
+
+BOT_SIGNATURES = (
+    # ── Generic crawler verbs ──
+    "bot", "crawl", "spider", "slurp", "reader", "fetch",
+    "monitor", "analyzer", "healthcheck",
+
+    # ── Programming languages / HTTP libraries ──
+    "python", "requests", "urllib", "java",
+    "okhttp", "curl", "wget", "libwww",
+    "httpclient", "go-http-client", "axios",
+    "got", "postman", "insomnia",
+
+    # ── Headless browsers / testing tools ──
+    "headlesschrome", "phantomjs", "puppeteer",
+    "playwright", "selenium", "chromedp",
+    "lighthouse", "pagespeed",
+
+    # ── Major search / SEO crawlers (roots without “bot”) ──
+    "ahrefs", "semrush", "yandex",
+
+    # ── AI / LLM harvesters (roots without “bot”) ──
+    "openai", "chatgpt", "oai-search", "perplexity",
+    "googleother", "google-read-aloud",
+
+    # ── Social-media link fetchers lacking “bot” ──
+    "facebookexternalhit", "embedly", "whatsapp",
+
+    # ── Uptime & infrastructure monitors ──
+    "pingdom", "statuscake",
+
+    # ── Misc keywords ──
+    "support", "feed", "spreadsheet", "script", "about",
+)
+
+# what classify() returns for a blank or missing User-Agent, which almost always means a bot
+MISSING_USER_AGENT = '-'
+
+
+class BotClassifier:
+    """
+    classify() returns the first of the signatures found in a User-Agent, MISSING_USER_AGENT
+    for a blank one and None for a browser.
+    """
+
+    def __init__(self, signatures: Iterable[str] = BOT_SIGNATURES, cache_size: int = 4096):
+        self.signatures = tuple(dict.fromkeys(signature.lower() for signature in signatures))
+        self.classify = functools.lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, user_agent: str) -> Optional[str]:
+        user_agent = user_agent.lower().strip()
+        if not user_agent or user_agent == '-':
+            return MISSING_USER_AGENT
+        for signature in self.signatures:
+            if signature in user_agent:
+                return signature
+        return None
+
+    def is_bot(self, user_agent: str) -> bool:
+        return self.classify(user_agent) is not None
+
+    def cache_info(self):
+        return self.classify.cache_info()
+
+
+bot_classifier = BotClassifier()
+
+
+def is_bot_request(request) -> bool:
+    """True for a request (Django style, with META) whose User-Agent looks like a bot."""
+    return bot_classifier.classify(request.META.get("HTTP_USER_AGENT", "")) is not None
@@ -2,152 +2,182 @@
 
 import argparse
 import os
-import re
-from collections import defaultdict, Counter
-from datetime import datetime, timedelta
+import sys
 
-def parse_log_line(log_line: str):
+from log_follow import LogFollower, RateMonitor, format_alert
+from log_stats import (CHUNK_BYTES, INTERVAL_SECONDS, LOG_LINE_REGEX, IntervalAggregator, analyze_files,
+                       expand_paths, format_interval, interval_minutes, stream_intervals)
+
+def summarize_log_by_interval(log_file_path: str, interval_seconds: int = INTERVAL_SECONDS):
     """
-    Parse a single nginx access.log line.
-    Returns a tuple (client_ip: str, timestamp: datetime, request_path: str),
-    or (None, None, None) if parsing fails.
+    Read the log file and yield an IntervalStats per interval (5 minutes by default) as soon as
+    it is complete, with the total/transcripts/valuation/other counts and per-client-IP request
+    count and shortest gap. Memory does not grow with the number of requests.
     """
-    # Regex to extract timestamp, request path, and client IP (last quoted field)
-    regex_pattern = (
-        r'\['
-            r'(?P<timestamp>[0-9]{2}/[A-Za-z]{3}/[0-9]{4}:[0-9]{2}:[0-9]{2}:[0-9]{2} [+\-][0-9]{4})'
-        r'\]\s+"[A-Z]+ '
-            r'(?P<path>[^ ]+) '
-            r'HTTP/[^"]+"'
-        r'\s+\d+\s+\d+'
-        r'\s+"[^"]*"\s+"[^"]*"'
-        r'\s+"(?P<client_ip>[^"]+)"'
-    )
-    match = re.search(regex_pattern, log_line)
-    if not match:
-        return None, None, None
-
-    timestamp_str = match.group('timestamp')
-    request_path = match.group('path')
-    client_ip = match.group('client_ip')
-    timestamp = datetime.strptime(timestamp_str, "%d/%b/%Y:%H:%M:%S %z")
-    return client_ip, timestamp, request_path
+    aggregator = IntervalAggregator(interval_seconds)
+    with open(log_file_path, 'r', encoding='utf-8') as log_file:
+        yield from stream_intervals(log_file, aggregator)
+    report_late_lines(aggregator)
 
-def round_down_to_five_minutes(timestamp: datetime):
+def report_late_lines(aggregator):
     """
-    Round a datetime down to the nearest 5-minute mark.
+    Tell on stderr how many lines were skipped because their interval had already been printed.
     """
-    minute_floor = (timestamp.minute // 5) * 5
-    return timestamp.replace(minute=minute_floor, second=0, microsecond=0)
+    if aggregator.late:
+        print(f"{aggregator.late} lines skipped, their interval was already complete "
+              f"(more than {aggregator.grace}s out of order)", file=sys.stderr, flush=True)
 
-def summarize_log_by_interval(log_file_path: str):
+def summarize_logs(log_file_paths, workers=None, chunk_bytes=CHUNK_BYTES, interval_seconds=INTERVAL_SECONDS):
     """
-    Read the log file, bucket entries into 5-minute intervals,
-    count total/transcripts/valuation/other, and record per-client-IP timestamps.
+    Summaries of all intervals of many log files, plain and .gz, read in parallel by worker
+    processes and merged. Intervals present in several files are added up.
     """
-    tracked_segments = ['/transcripts', '/valuation']
-
-    # Counters per interval
-    counters_by_interval = defaultdict(lambda: Counter({
-        'total': 0,
-        '/transcripts': 0,
-        '/valuation': 0,
-        'other': 0
-    }))
-    # Per-interval → client_ip → [timestamps]
-    ip_timestamps_by_interval = defaultdict(lambda: defaultdict(list))
-
-    with open(log_file_path, 'r', encoding='utf-8') as log_file:
-        for line in log_file:
-            client_ip, timestamp, request_path = parse_log_line(line)
-            if timestamp is None:
-                continue
-
-            interval_start = round_down_to_five_minutes(timestamp)
-            interval_counters = counters_by_interval[interval_start]
-            interval_counters['total'] += 1
+    return analyze_files(log_file_paths, workers=workers, chunk_bytes=chunk_bytes, interval_seconds=interval_seconds)
 
-            # classify path
-            for segment in tracked_segments:
-                if segment in request_path:
-                    interval_counters[segment] += 1
-                    break
-            else:
-                interval_counters['other'] += 1
-
-            # record timestamp per client IP
-            ip_timestamps_by_interval[interval_start][client_ip].append(timestamp)
-
-    return counters_by_interval, ip_timestamps_by_interval
-
-def compute_shortest_interval(sorted_timestamps):
+def summarize_index(index_directory, interval_seconds=INTERVAL_SECONDS):
     """
-    Given a sorted list of datetimes, return the shortest delta in seconds
-    between successive entries. If fewer than 2 timestamps, return None.
+    Summaries of all intervals from a columnar index made by `log_index.py ingest`, without
+    parsing the log text again.
     """
-    if len(sorted_timestamps) < 2:
-        return None
-    shortest_delta = None
-    for previous, current in zip(sorted_timestamps, sorted_timestamps[1:]):
-        delta_seconds = (current - previous).total_seconds()
-        if shortest_delta is None or delta_seconds < shortest_delta:
-            shortest_delta = delta_seconds
-    return int(shortest_delta)
+    from log_index import LogIndex
+    return LogIndex(index_directory).summaries(interval_seconds)
 
-def print_summary(counters_by_interval, ip_timestamps_by_interval):
+def print_summary(intervals):
     """
-    Print the counts for each 5-minute interval and top-5 client-IP frequency stats.
+    Print the counts for each 5-minute interval and top-10 client-IP frequency stats,
+    each interval as soon as it is available.
     """
-    for interval_start in sorted(counters_by_interval):
-        interval_end = interval_start + timedelta(minutes=5)
-        counts = counters_by_interval[interval_start]
-
-        print(f"{interval_start.strftime('%H:%M')}–{interval_end.strftime('%H:%M')}")
-        print(f"  Total requests:    {counts['total']}")
-        print(f"  '/transcripts':    {counts['/transcripts']}")
-        print(f"  '/valuation':      {counts['/valuation']}")
-        print(f"  Other paths:       {counts['other']}")
+    for stats in intervals:
+        print(format_interval(stats), flush=True)
 
-        # Gather per-IP stats
-        ip_stats = []
-        for client_ip, timestamps in ip_timestamps_by_interval[interval_start].items():
-            request_count = len(timestamps)
-            sorted_timestamps = sorted(timestamps)
-            shortest_gap = compute_shortest_interval(sorted_timestamps)
-            ip_stats.append((client_ip, request_count, shortest_gap))
-
-        # Top 10 IPs by request_count
-        top_five_ips = sorted(ip_stats, key=lambda item: item[1], reverse=True)[:10]
-        if top_five_ips:
-            print("  Top 10 client IPs:")
-            for ip_address, request_count, shortest_gap in top_five_ips:
-                gap_text = f"{shortest_gap}s" if shortest_gap is not None else "N/A"
-                print(f"    • {ip_address}: {request_count} requests, "
-                      f"shortest interval {gap_text}")
-        print()
+def follow_log(follower: LogFollower, monitor: RateMonitor, interval_seconds: int = INTERVAL_SECONDS):
+    """
+    Print the summary of every interval of a live log once it is complete, and an
+    alert line as soon as a client IP crosses a threshold of the monitor. After a restart
+    from a checkpoint the first interval only counts the lines read since then.
+    """
+    aggregator = IntervalAggregator(interval_seconds)
+    try:
+        for line in follower.lines():
+            match = LOG_LINE_REGEX.search(line)
+            if not match:
+                continue
+            epoch, timestamp = aggregator.parse_timestamp(match.group('timestamp'))
+            client_ip, request_path = match.group('client_ip'), match.group('path')
+            for alert in monitor.add(client_ip, epoch, request_path):
+                print(format_alert(alert, monitor.window), flush=True)
+            late = aggregator.late
+            for stats in aggregator.add(client_ip, epoch, timestamp, request_path):
+                print(format_interval(stats), flush=True)
+            if aggregator.late > late:
+                print(f"late line skipped, its interval was already printed: {line.rstrip()}",
+                      file=sys.stderr, flush=True)
+    finally:
+        follower.save()
 
 def main():
     parser = argparse.ArgumentParser(
         description="Summarize nginx access.log by 5-minute intervals."
     )
     parser.add_argument(
-        'log_file',
-        nargs='?',
-        help="Path to nginx access.log (defaults to ./access.log)"
+        '--interval',
+        type=interval_minutes,
+        default=INTERVAL_SECONDS // 60,
+        help="Minutes per interval of the summary"
+    )
+    parser.add_argument(
+        '--index',
+        help="Summarize a columnar index of log_index.py instead of log files"
+    )
+    parser.add_argument(
+        'log_files',
+        nargs='*',
+        help="Paths or glob patterns of nginx access logs, also .gz (defaults to ./access.log)"
+    )
+    parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=None,
+        help="Worker processes for several or large files (defaults to the number of CPUs)"
+    )
+    parser.add_argument(
+        '--chunk-mb',
+        type=int,
+        default=CHUNK_BYTES // (1024 * 1024),
+        help="Size of the pieces large files are split into for the workers"
+    )
+    follow = parser.add_argument_group('follow mode')
+    follow.add_argument(
+        '--follow',
+        action='store_true',
+        help="Tail one live log across rotations, print intervals when complete and alerts"
+    )
+    follow.add_argument(
+        '--checkpoint',
+        help="File keeping the read offset between runs (defaults to the log path + '.checkpoint')"
+    )
+    follow.add_argument(
+        '--from-start',
+        action='store_true',
+        help="Without a checkpoint, read the existing lines too instead of only new ones"
+    )
+    follow.add_argument('--poll', type=float, default=1.0, help="Seconds between checks for new lines")
+    follow.add_argument(
+        '--max-rate',
+        type=int,
+        default=120,
+        help="Alert when an IP makes more requests to a tracked endpoint in 5 minutes"
+    )
+    follow.add_argument(
+        '--min-gap',
+        type=int,
+        default=1,
+        help="Alert when requests of a busy IP to a tracked endpoint are this many seconds apart or less"
+    )
+    follow.add_argument(
+        '--min-requests',
+        type=int,
+        default=20,
+        help="Requests in 5 minutes from which an IP counts as busy for --min-gap"
     )
     args = parser.parse_args()
-
-    if args.log_file:
-        log_file_path = args.log_file
+    interval_seconds = args.interval * 60
+
+    if args.index:
+        if args.follow or args.log_files:
+            parser.error("--index takes no log files")
+        print_summary(summarize_index(args.index, interval_seconds))
+        return
+
+    if args.follow:
+        if len(args.log_files) > 1:
+            parser.error("--follow takes one log file")
+        if args.log_files:
+            log_file_path = args.log_files[0]
+        else:
+            log_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'access.log')
+        follower = LogFollower(log_file_path, args.checkpoint or log_file_path + '.checkpoint',
+                               poll=args.poll, from_start=args.from_start)
+        monitor = RateMonitor(max_rate=args.max_rate, min_gap=args.min_gap, min_requests=args.min_requests)
+        try:
+            follow_log(follower, monitor, interval_seconds)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.log_files:
+        log_file_paths = expand_paths(args.log_files)
     else:
         script_directory = os.path.dirname(os.path.abspath(__file__))
-        log_file_path = os.path.join(script_directory, 'access.log')
+        log_file_paths = expand_paths([os.path.join(script_directory, 'access.log')])
 
-    if not os.path.isfile(log_file_path):
-        raise FileNotFoundError(f"No log file found at {log_file_path!r}")
-
-    counters_by_interval, ip_timestamps_by_interval = summarize_log_by_interval(log_file_path)
-    print_summary(counters_by_interval, ip_timestamps_by_interval)
+    chunk_bytes = args.chunk_mb * 1024 * 1024
+    single = len(log_file_paths) == 1 and not log_file_paths[0].endswith('.gz')
+    if single and (args.workers == 1 or os.path.getsize(log_file_paths[0]) <= chunk_bytes):
+        # streamed, each interval is printed as soon as it is complete
+        print_summary(summarize_log_by_interval(log_file_paths[0], interval_seconds))
+    else:
+        print_summary(summarize_logs(log_file_paths, args.workers, chunk_bytes, interval_seconds))
 
 if __name__ == "__main__":
     main()
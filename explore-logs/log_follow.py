@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+log_follow.py
+-------------
+Live side of the log tools: LogFollower tails an nginx access log across rotations and keeps
+its byte offset in a checkpoint file, RateMonitor keeps rolling windows per client IP of the
+requests to the tracked endpoints and raises an Alert when an IP asks too often or too fast.
+
+    python explore-logs.py --follow /var/log/nginx/access.log --max-rate 120 --min-gap 1
+
+Windows move with the timestamps of the log lines, not with the wall clock, so replaying a
+log raises the same alerts as following it did.
+"""
+
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from log_stats import INTERVAL_SECONDS, TRACKED_SEGMENTS
+
+
+class Alert(NamedTuple):
+    epoch: int
+    client_ip: str
+    segment: str
+    kind: str  # 'rate' or 'gap'
+    value: int
+    threshold: int
+    requests: int
+
+
+def format_alert(alert: Alert, window: int = INTERVAL_SECONDS) -> str:
+    when = datetime.fromtimestamp(alert.epoch, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    if alert.kind == 'rate':
+        detail = f"{alert.value} requests in {window}s (limit {alert.threshold})"
+    else:
+        detail = (f"requests {alert.value}s apart, {alert.requests} in {window}s "
+                  f"(limit {alert.threshold}s)")
+    return f"ALERT {when} {alert.client_ip} {alert.segment}: {detail}"
+
+
+class _Track:
+    """Requests of one IP to one segment in the window."""
+
+    __slots__ = ('times', 'gaps', 'alerted')
+
+    def __init__(self):
+        self.times = deque()
+        # (previous epoch, gap) with increasing gaps, the first one is the shortest in the window
+        self.gaps = deque()
+        self.alerted = {}
+
+
+class RateMonitor:
+    """
+    Rolling window of `window` seconds per client IP and tracked segment, updated per line.
+
+    add() returns an Alert when an IP made more than max_rate requests in the window, or when
+    it made at least min_requests and two of them were at most min_gap seconds apart. The same
+    alert is not repeated for `cooldown` seconds, by default one window.
+    """
+
+    def __init__(self, window: int = INTERVAL_SECONDS, max_rate: int = 120, min_gap: int = 1,
+                 min_requests: int = 20, tracked_segments: Iterable[str] = TRACKED_SEGMENTS,
+                 cooldown: Optional[int] = None):
+        self.window = window
+        self.max_rate = max_rate
+        self.min_gap = min_gap
+        self.min_requests = min_requests
+        self.tracked_segments = tuple(tracked_segments)
+        self.cooldown = window if cooldown is None else cooldown
+        self.alerts = 0
+        self._tracks: Dict[tuple, _Track] = {}
+        self._newest = None
+        self._swept = None
+
+    def add(self, client_ip: str, epoch: int, request_path: str) -> List[Alert]:
+        for segment in self.tracked_segments:
+            if segment in request_path:
+                break
+        else:
+            return []
+        if self._newest is None or epoch > self._newest:
+            self._newest = epoch
+            if self._swept is None or epoch - self._swept >= self.window:
+                self._sweep(epoch - self.window)
+
+        track = self._tracks.get((client_ip, segment))
+        if track is None:
+            track = self._tracks[(client_ip, segment)] = _Track()
+        times = track.times
+        if times:
+            gap = abs(epoch - times[-1])
+            gaps = track.gaps
+            while gaps and gaps[-1][1] >= gap:
+                gaps.pop()
+            gaps.append((min(epoch, times[-1]), gap))
+        times.append(epoch)
+        self._expire(track, self._newest - self.window)
+
+        alerts = []
+        requests = len(times)
+        if requests > self.max_rate:
+            alerts.append(Alert(epoch, client_ip, segment, 'rate', requests, self.max_rate, requests))
+        if requests >= self.min_requests and track.gaps and track.gaps[0][1] <= self.min_gap:
+            alerts.append(Alert(epoch, client_ip, segment, 'gap', track.gaps[0][1], self.min_gap, requests))
+        alerts = [alert for alert in alerts if self._due(track, alert)]
+        self.alerts += len(alerts)
+        return alerts
+
+    def _due(self, track: _Track, alert: Alert) -> bool:
+        last = track.alerted.get(alert.kind)
+        if last is not None and alert.epoch - last < self.cooldown:
+            return False
+        track.alerted[alert.kind] = alert.epoch
+        return True
+
+    @staticmethod
+    def _expire(track: _Track, limit: int):
+        # a request is in the window while it is newer than limit, a gap while both ends are
+        times = track.times
+        while times and times[0] <= limit:
+            times.popleft()
+        gaps = track.gaps
+        while gaps and gaps[0][0] <= limit:
+            gaps.popleft()
+
+    def _sweep(self, limit: int):
+        # forget the IPs that went quiet, so memory follows the active clients
+        self._swept = self._newest
+        for key in [key for key, track in self._tracks.items() if not track.times or track.times[-1] <= limit]:
+            track = self._tracks[key]
+            if not track.alerted or max(track.alerted.values()) <= limit - self.cooldown:
+                del self._tracks[key]
+            else:
+                self._expire(track, limit)
+
+    def __len__(self):
+        return len(self._tracks)
+
+
+class LogFollower:
+    """
+    Yield the lines appended to a log file, like tail -F.
+
+    The offset after the last complete line is written to `checkpoint` (JSON with the inode)
+    at most every save_every seconds while reading and whenever the file is idle, so a restart
+    goes on where the last run stopped. A rotated file (renamed, a new one created) is read
+    to its end before the new file; after a rename during a restart the rest is read from
+    path + '.1' when that is the checkpointed file. A truncated file is read from the start.
+    Without a checkpoint only new lines are read, unless from_start.
+    """
+
+    def __init__(self, path: str, checkpoint: Optional[str] = None, poll: float = 1.0,
+                 from_start: bool = False, save_every: float = 5.0):
+        self.path = path
+        self.checkpoint = checkpoint
+        self.poll = poll
+        self.from_start = from_start
+        self.save_every = save_every
+        self.inode = None
+        self.offset = 0
+        self.rotations = 0
+        self._saved = None
+
+    def _load(self) -> Optional[dict]:
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return None
+        with open(self.checkpoint, 'r') as f:
+            return json.load(f)
+
+    def save(self):
+        """Write the checkpoint if the offset moved since the last save."""
+        if not self.checkpoint or self.inode is None or self._saved == (self.inode, self.offset):
+            return
+        state = {'path': os.path.abspath(self.path), 'inode': self.inode, 'offset': self.offset,
+                 'saved': int(time.time())}
+        temporary = self.checkpoint + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary, self.checkpoint)
+        self._saved = (self.inode, self.offset)
+
+    def _open(self, path: str, offset: int):
+        log_file = open(path, 'rb')
+        self.inode = os.fstat(log_file.fileno()).st_ino
+        self.offset = offset
+        log_file.seek(offset)
+        return log_file
+
+    def _start(self):
+        state = self._load()
+        while True:
+            try:
+                current = os.stat(self.path)
+                break
+            except FileNotFoundError:
+                time.sleep(self.poll)
+        if state is None:
+            return None, self._open(self.path, 0 if self.from_start else current.st_size)
+        if state['inode'] == current.st_ino and state['offset'] <= current.st_size:
+            return None, self._open(self.path, state['offset'])
+        rotated = self.path + '.1'
+        try:
+            if os.stat(rotated).st_ino == state['inode']:
+                # rotated while we were not running, finish the old file first
+                return self._open(rotated, state['offset']), None
+        except FileNotFoundError:
+            pass
+        return None, self._open(self.path, 0)
+
+    def lines(self) -> Iterator[str]:
+        old_file, log_file = self._start()
+        if old_file is not None:
+            with old_file:
+                yield from self._read(old_file)
+            self.rotations += 1
+            log_file = self._open(self.path, 0)
+        last_save = time.monotonic()
+        try:
+            while True:
+                for line in self._read(log_file):
+                    yield line
+                    if time.monotonic() - last_save >= self.save_every:
+                        self.save()
+                        last_save = time.monotonic()
+                self.save()
+                last_save = time.monotonic()
+                change = self._change()
+                if change == 'rotated':
+                    # nginx writes to the old file until it reopens its logs, finish it first
+                    yield from self._read(log_file)
+                if change is not None:
+                    log_file.close()
+                    self.rotations += 1
+                    log_file = self._open(self.path, 0)
+                    continue
+                time.sleep(self.poll)
+        finally:
+            log_file.close()
+
+    def _read(self, log_file) -> Iterator[str]:
+        # only complete lines, a partly written one is read again on the next poll
+        while True:
+            line = log_file.readline()
+            if not line:
+                return
+            if not line.endswith(b'\n'):
+                log_file.seek(self.offset)
+                return
+            self.offset += len(line)
+            yield line.decode('utf-8', errors='replace')
+
+    def _change(self) -> Optional[str]:
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            # between the rename and the creation of the new file
+            return None
+        if current.st_ino != self.inode:
+            return 'rotated'
+        if current.st_size < self.offset:
+            # copytruncate
+            return 'truncated'
+        return None
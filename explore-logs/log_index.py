@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+log_index.py
+------------
+Columnar index of nginx access logs: parse the text once, then answer questions about it with
+NumPy in milliseconds instead of running the line regex again.
+
+    python log_index.py ingest index/ access.log 'archive/access.log.*.gz'
+    python log_index.py summary index/ --interval 1 --path /valuation
+    python log_index.py top index/ --column user_agent --path /transcripts -n 20
+    python log_index.py bots index/ --start 2025-07-12T09:00 --end 2025-07-12T10:00
+
+An index is a directory with one .npy file per column, memory mapped when opened, sorted by
+time:
+    epoch       int64   seconds since 1970 of the request
+    ip          uint32  id of the client IP (last quoted field)
+    path        uint32  id of the request path
+    user_agent  uint32  id of the User-Agent
+    status      uint16  HTTP status
+and ips.json, paths.json, user_agents.json with the strings of the ids, in the order they
+first appear, plus meta.json. Path filters are evaluated on the few distinct paths and then
+become an id lookup over the rows.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from functools import cached_property
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy
+
+from bot_classifier import bot_classifier
+from log_stats import (INTERVAL_SECONDS, LOG_LINE_REGEX, TRACKED_SEGMENTS, IntervalStats, TimestampParser,
+                       expand_paths, format_interval, interval_minutes)
+
+COLUMNS = {'epoch': numpy.int64, 'ip': numpy.uint32, 'path': numpy.uint32, 'user_agent': numpy.uint32,
+           'status': numpy.uint16}
+DICTIONARIES = {'ip': 'ips.json', 'path': 'paths.json', 'user_agent': 'user_agents.json'}
+
+Time = Union[int, datetime, None]
+
+
+def ingest(paths: Iterable[str], directory: str) -> 'LogIndex':
+    """Parse the log files (plain or .gz) into a new index in directory, replacing an old one."""
+    parse_timestamp = TimestampParser()
+    columns = {'epoch': array('q'), 'ip': array('L'), 'path': array('L'), 'user_agent': array('L'),
+               'status': array('H')}
+    dictionaries = {name: {} for name in DICTIONARIES}
+    files = []
+    lines = skipped = 0
+    utc_offset = None
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        file_lines = 0
+        with opener(path, 'rt', encoding='utf-8', errors='replace') as log_file:
+            for line in log_file:
+                file_lines += 1
+                match = LOG_LINE_REGEX.search(line)
+                if match is None:
+                    skipped += 1
+                    continue
+                epoch, timestamp = parse_timestamp(match.group('timestamp'))
+                if utc_offset is None:
+                    utc_offset = int(timestamp.utcoffset().total_seconds())
+                columns['epoch'].append(epoch)
+                columns['status'].append(int(match.group('status')))
+                for name, ids in dictionaries.items():
+                    value = match.group('client_ip' if name == 'ip' else name)
+                    value_id = ids.get(value)
+                    if value_id is None:
+                        value_id = ids[value] = len(ids)
+                    columns[name].append(value_id)
+        lines += file_lines
+        stat = os.stat(path)
+        files.append({'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': int(stat.st_mtime),
+                      'lines': file_lines})
+
+    # several files are not in time order, a stable sort keeps the order of a second's lines
+    epochs = numpy.frombuffer(columns['epoch'], dtype=numpy.int64)
+    order = numpy.argsort(epochs, kind='stable')
+    temporary = directory.rstrip('/') + '.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    for name, dtype in COLUMNS.items():
+        values = numpy.frombuffer(columns[name], dtype=columns[name].typecode).astype(dtype, copy=False)
+        numpy.save(os.path.join(temporary, name + '.npy'), values[order])
+    for name, filename in DICTIONARIES.items():
+        with open(os.path.join(temporary, filename), 'w') as f:
+            json.dump(list(dictionaries[name]), f)
+    meta = {'files': files, 'rows': len(order), 'lines': lines, 'skipped': skipped,
+            'utc_offset': utc_offset or 0, 'created': int(time.time())}
+    with open(os.path.join(temporary, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary, directory)
+    return LogIndex(directory)
+
+
+class LogIndex:
+    """
+    Read side of an index. select() returns the row numbers of a time range and filters,
+    the other queries take such rows (all rows by default).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.zone = timezone(timedelta(seconds=self.meta['utc_offset']))
+        for name in COLUMNS:
+            setattr(self, name, numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.epoch)
+
+    def _dictionary(self, name: str) -> List[str]:
+        with open(os.path.join(self.directory, DICTIONARIES[name]), 'r') as f:
+            return json.load(f)
+
+    @cached_property
+    def ips(self) -> List[str]:
+        return self._dictionary('ip')
+
+    @cached_property
+    def paths(self) -> List[str]:
+        return self._dictionary('path')
+
+    @cached_property
+    def user_agents(self) -> List[str]:
+        return self._dictionary('user_agent')
+
+    @cached_property
+    def bot_user_agents(self) -> numpy.ndarray:
+        """True per User-Agent id for the ones bot_classifier takes for a bot."""
+        return numpy.fromiter((bot_classifier.is_bot(user_agent) for user_agent in self.user_agents),
+                              dtype=bool, count=len(self.user_agents))
+
+    def path_ids(self, *segments: str) -> numpy.ndarray:
+        """Ids of the paths that contain one of the segments."""
+        return numpy.array([path_id for path_id, path in enumerate(self.paths)
+                            if any(segment in path for segment in segments)], dtype=numpy.uint32)
+
+    def _epoch(self, value: Time) -> Optional[int]:
+        if isinstance(value, datetime):
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=self.zone)
+            return int(value.timestamp())
+        return value
+
+    def select(self, start: Time = None, end: Time = None, path: Union[str, Tuple[str, ...], None] = None,
+               ip: Optional[str] = None, status: Union[int, Tuple[int, ...], None] = None,
+               bots: Optional[bool] = None) -> numpy.ndarray:
+        """
+        Row numbers from start (included) to end (excluded), of requests whose path contains
+        path (or one of several), from ip, with status, and from bots or from humans.
+        """
+        first = 0 if start is None else int(numpy.searchsorted(self.epoch, self._epoch(start), 'left'))
+        last = len(self) if end is None else int(numpy.searchsorted(self.epoch, self._epoch(end), 'left'))
+        mask = numpy.ones(max(last - first, 0), dtype=bool)
+        if path is not None:
+            mask &= numpy.isin(self.path[first:last], self.path_ids(*((path,) if isinstance(path, str) else path)))
+        if ip is not None:
+            ip_id = self.ips.index(ip) if ip in self.ips else -1
+            mask &= self.ip[first:last] == ip_id
+        if status is not None:
+            mask &= numpy.isin(self.status[first:last], numpy.atleast_1d(status))
+        if bots is not None:
+            mask &= self.bot_user_agents[self.user_agent[first:last]] == bots
+        return numpy.flatnonzero(mask) + first
+
+    def _rows(self, rows: Optional[numpy.ndarray]) -> numpy.ndarray:
+        return numpy.arange(len(self)) if rows is None else rows
+
+    def histogram(self, interval_seconds: int = INTERVAL_SECONDS,
+                  rows: Optional[numpy.ndarray] = None) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """(interval start epochs, request counts) of the intervals with requests."""
+        epochs = self.epoch if rows is None else self.epoch[rows]
+        return numpy.unique(epochs - epochs % interval_seconds, return_counts=True)
+
+    def top(self, column: str = 'ip', n: int = 10, rows: Optional[numpy.ndarray] = None) -> List[Tuple[str, int]]:
+        """The n most frequent values of a dictionary column, ties in the order they first appeared."""
+        ids = getattr(self, column) if rows is None else getattr(self, column)[rows]
+        counts = numpy.bincount(ids)
+        # ids are numbered by first appearance, a stable sort keeps that order for ties
+        order = numpy.argsort(-counts, kind='stable')[:n]
+        values = {'ip': self.ips, 'path': self.paths, 'user_agent': self.user_agents}.get(column)
+        return [(values[value_id] if values else int(value_id), int(counts[value_id]))
+                for value_id in order if counts[value_id]]
+
+    def bot_split(self, rows: Optional[numpy.ndarray] = None) -> Dict[str, int]:
+        user_agents = self.user_agent if rows is None else self.user_agent[rows]
+        bots = int(numpy.count_nonzero(self.bot_user_agents[user_agents]))
+        return {'bots': bots, 'humans': len(user_agents) - bots}
+
+    def summaries(self, interval_seconds: int = INTERVAL_SECONDS, top: int = 10,
+                  rows: Optional[numpy.ndarray] = None,
+                  tracked_segments: Iterable[str] = TRACKED_SEGMENTS) -> List[IntervalStats]:
+        """
+        What explore-logs.py reports, for any interval length and rows: per interval the
+        counts by tracked segment and the top client IPs with their shortest gap.
+        """
+        tracked_segments = tuple(tracked_segments)
+        rows = self._rows(rows)
+        epochs = numpy.asarray(self.epoch[rows])
+        if not len(epochs):
+            return []
+        keys, bucket_of_row = numpy.unique(epochs - epochs % interval_seconds, return_inverse=True)
+
+        # segment of every path id, the first tracked segment it contains, or other
+        segment_of_path = numpy.full(len(self.paths), len(tracked_segments), dtype=numpy.int64)
+        for index, segment in reversed(list(enumerate(tracked_segments))):
+            segment_of_path[self.path_ids(segment)] = index
+        segments = segment_of_path[self.path[rows]]
+        counts = numpy.bincount(bucket_of_row * (len(tracked_segments) + 1) + segments,
+                                minlength=len(keys) * (len(tracked_segments) + 1))
+        counts = counts.reshape(len(keys), len(tracked_segments) + 1)
+
+        # one group per interval and IP, rows of a group in time order
+        group_keys = bucket_of_row.astype(numpy.int64) * len(self.ips) + self.ip[rows]
+        order = numpy.argsort(group_keys, kind='stable')
+        sorted_keys = group_keys[order]
+        starts = numpy.flatnonzero(numpy.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = numpy.diff(numpy.r_[starts, len(order)])
+        first_row = order[starts]
+        gaps = numpy.diff(epochs[order])
+        no_gap = numpy.iinfo(numpy.int64).max
+        gaps = numpy.where(sorted_keys[1:] == sorted_keys[:-1], gaps, no_gap)
+        shortest = numpy.minimum.reduceat(numpy.r_[gaps, no_gap], starts)
+        group_bucket = bucket_of_row[first_row]
+
+        # per interval the largest groups first, ties by the first request
+        ranked = numpy.lexsort((first_row, -sizes, group_bucket))
+        bucket_starts = numpy.searchsorted(group_bucket[ranked], numpy.arange(len(keys)))
+        rank = numpy.arange(len(ranked)) - bucket_starts[group_bucket[ranked]]
+        chosen = ranked[rank < top]
+
+        ips = self.ips
+        ip_ids = self.ip[rows]
+        summaries = []
+        for bucket, key in enumerate(keys.tolist()):
+            start = datetime.fromtimestamp(key, self.zone)
+            stats = IntervalStats(start, start + timedelta(seconds=interval_seconds), tracked_segments)
+            bucket_counts = counts[bucket].tolist()
+            stats.counts['total'] = sum(bucket_counts)
+            for segment, count in zip(tracked_segments + ('other',), bucket_counts):
+                stats.counts[segment] = count
+            summaries.append(stats)
+        for group in chosen.tolist():
+            size = int(sizes[group])
+            row = int(first_row[group])
+            last = int(epochs[order[starts[group] + size - 1]])
+            gap = int(shortest[group]) if size > 1 else None
+            summaries[group_bucket[group]].ips[ips[ip_ids[row]]] = [size, int(epochs[row]), [last], gap]
+        return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar index of nginx access logs and queries over it.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help="parse log files into an index directory")
+    ingest_parser.add_argument('index')
+    ingest_parser.add_argument('log_files', nargs='+', help="paths or glob patterns, also .gz")
+
+    for name, help_text in (('summary', "interval summaries like explore-logs.py"),
+                            ('top', "most frequent IPs, paths or User-Agents"),
+                            ('bots', "requests from bots and from humans")):
+        query = commands.add_parser(name, help=help_text)
+        query.add_argument('index')
+        query.add_argument('--start', type=datetime.fromisoformat, help="ISO time, in the zone of the log")
+        query.add_argument('--end', type=datetime.fromisoformat, help="ISO time, excluded")
+        query.add_argument('--path', nargs='+', help="only paths containing one of these")
+        query.add_argument('--ip', help="only this client IP")
+        query.add_argument('--status', type=int, nargs='+', help="only these HTTP statuses")
+        query.add_argument('--bots', choices=('only', 'exclude'), help="only or no bot requests")
+        if name == 'summary':
+            query.add_argument('--interval', type=interval_minutes, default=INTERVAL_SECONDS // 60,
+                               help="minutes per interval, like explore-logs.py")
+            query.add_argument('--top', type=int, default=10, help="client IPs per interval")
+        elif name == 'top':
+            query.add_argument('--column', choices=tuple(DICTIONARIES), default='ip')
+            query.add_argument('-n', type=int, default=10)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == 'ingest':
+        index = ingest(expand_paths(args.log_files), args.index)
+        print(f"{len(index)} requests of {len(index.meta['files'])} files, {index.meta['skipped']} lines skipped, "
+              f"{len(index.ips)} IPs, {len(index.paths)} paths, {len(index.user_agents)} User-Agents "
+              f"in {time.perf_counter() - started:.2f}s")
+        return
+
+    index = LogIndex(args.index)
+    rows = index.select(args.start, args.end, tuple(args.path) if args.path else None, args.ip,
+                        tuple(args.status) if args.status else None,
+                        None if args.bots is None else args.bots == 'only')
+    if args.command == 'summary':
+        for stats in index.summaries(args.interval * 60, args.top, rows):
+            print(format_interval(stats, args.top))
+    elif args.command == 'top':
+        for value, count in index.top(args.column, args.n, rows):
+            print(f"{count:>8} × {value}")
+    else:
+        split = index.bot_split(rows)
+        print(f"bots:   {split['bots']:>8}\nhumans: {split['humans']:>8}")
+    print(f"{len(rows)} requests queried in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+log_stats.py
+------------
+Streaming statistics over nginx access.log lines in 5-minute intervals, shared by
+explore-logs.py and the other log tools.
+
+Only online state is kept: per interval the path counters and, per client IP, the request
+count, the sorted timestamps of its lines of the last `grace` seconds and the shortest gap
+so far. An interval is handed out as soon as a line more than `grace` seconds (5 minutes by
+default) past its end is read, so memory depends on the number of client IPs of the open
+intervals and their recent requests, not on all requests. Lines that come even later are
+counted in IntervalAggregator.late.
+
+analyze_files() does the same for many files at once: plain files are cut into newline
+aligned chunks read through mmap, .gz files are read whole, each by a worker process, and
+the IntervalStats of the parts are merged in the order the parts start.
+"""
+
+import argparse
+import glob
+import gzip
+import heapq
+import mmap
+import os
+import re
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# timestamp, request path, status, User-Agent and client IP (last quoted field) of a line
+LOG_LINE_REGEX = re.compile(
+    r'\['
+        r'(?P<timestamp>[0-9]{2}/[A-Za-z]{3}/[0-9]{4}:[0-9]{2}:[0-9]{2}:[0-9]{2} [+\-][0-9]{4})'
+    r'\]\s+"[A-Z]+ '
+        r'(?P<path>[^ ]+) '
+        r'HTTP/[^"]+"'
+    r'\s+(?P<status>\d+)\s+\d+'
+    r'\s+"[^"]*"\s+"(?P<user_agent>[^"]*)"'
+    r'\s+"(?P<client_ip>[^"]+)"'
+)
+
+TRACKED_SEGMENTS = ('/transcripts', '/valuation')
+INTERVAL_SECONDS = 5 * 60
+
+_MONTHS = {name: number for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), start=1)}
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class TimestampParser:
+    """
+    Parse '12/Jul/2025:09:07:59 +0000' into (epoch seconds, datetime).
+
+    Logs have many lines per second, the result of the last timestamp string is reused
+    instead of running strptime for every line.
+    """
+
+    def __init__(self):
+        self._last_text = None
+        self._last_value = None
+        self._zones = {}
+
+    def __call__(self, text: str) -> Tuple[int, datetime]:
+        if text == self._last_text:
+            return self._last_value
+        zone = self._zones.get(text[21:26])
+        if zone is None:
+            offset = text[21:26]
+            sign = -1 if offset[0] == '-' else 1
+            zone = self._zones[offset] = timezone(
+                sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])))
+        try:
+            timestamp = datetime(int(text[7:11]), _MONTHS[text[3:6]], int(text[0:2]),
+                                 int(text[12:14]), int(text[15:17]), int(text[18:20]), tzinfo=zone)
+        except KeyError:
+            # a month name strptime knows in another case, like 'JUL'
+            timestamp = datetime.strptime(text, "%d/%b/%Y:%H:%M:%S %z")
+        value = (int((timestamp - _EPOCH).total_seconds()), timestamp)
+        self._last_text = text
+        self._last_value = value
+        return value
+
+
+class IntervalStats:
+    """
+    Counters of one interval, `ips` maps a client IP to [requests, first epoch, sorted epochs
+    of its recent lines, shortest gap].
+    """
+
+    __slots__ = ('start', 'end', 'counts', 'ips')
+
+    def __init__(self, start: datetime, end: datetime, tracked_segments: Iterable[str] = TRACKED_SEGMENTS):
+        self.start = start
+        self.end = end
+        self.counts = Counter(dict.fromkeys(('total',) + tuple(tracked_segments) + ('other',), 0))
+        self.ips = {}
+
+    def top_ips(self, n: int = 10) -> List[Tuple[str, int, Optional[int]]]:
+        """
+        The n client IPs with the most requests as (ip, requests, shortest gap in seconds),
+        ties in the order the IPs first appeared. The gap is None for a single request.
+        """
+        top = heapq.nlargest(n, self.ips.items(), key=lambda item: item[1][0])
+        return [(ip, count, gap) for ip, (count, _, _, gap) in top]
+
+    def merge(self, later: 'IntervalStats') -> 'IntervalStats':
+        """
+        Add the counts of the same interval from input that comes after this one, like the next
+        chunk of the file. The gaps across the two parts are the ones between the recent lines
+        of the later part and their neighbours in time in this one.
+        """
+        self.counts.update(later.counts)
+        for ip, (count, first, recent, gap) in later.ips.items():
+            state = self.ips.get(ip)
+            if state is None:
+                self.ips[ip] = [count, first, list(recent), gap]
+                continue
+            gaps = [value for value in (state[3], gap) if value is not None]
+            gaps.extend(_neighbour_gap(state[2], epoch) for epoch in recent)
+            state[0] += count
+            state[1] = min(state[1], first)
+            state[2] = sorted(state[2] + recent)
+            state[3] = min(gaps)
+        return self
+
+
+def _neighbour_gap(recent: List[int], epoch: int) -> int:
+    # distance from epoch to the closest of the sorted epochs, which are never empty
+    index = bisect_right(recent, epoch)
+    if index == 0:
+        return recent[0] - epoch
+    if index == len(recent):
+        return epoch - recent[-1]
+    return min(epoch - recent[index - 1], recent[index] - epoch)
+
+
+class IntervalAggregator:
+    """
+    Online version of summarize_log_by_interval.
+
+    add() and add_line() return the intervals that closed because of the line, close()
+    returns the ones still open at the end of the input. An interval closes once a line more
+    than grace seconds past its end is read, by default 5 minutes later, so lines written
+    a little out of order still land in their interval. Lines of an interval that was already
+    handed out are counted in `late` and otherwise skipped. With grace=None nothing closes
+    before close().
+
+    The shortest gap of an IP is taken between its lines in time order, like sorting them
+    would. For that the epochs of the last grace seconds (interval_seconds with grace=None)
+    are kept per IP, a line further out of order is measured against what is left of them.
+    """
+
+    def __init__(self, interval_seconds: int = INTERVAL_SECONDS, tracked_segments: Iterable[str] = TRACKED_SEGMENTS,
+                 grace: Optional[int] = INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.tracked_segments = tuple(tracked_segments)
+        self.grace = grace
+        self.window = interval_seconds if grace is None else grace
+        self.lines = 0
+        self.skipped = 0
+        self.late = 0
+        self.parse_timestamp = TimestampParser()
+        self._open = {}
+        self._closed_until = None
+        self._newest = None
+
+    def add_line(self, line: str) -> List[IntervalStats]:
+        match = LOG_LINE_REGEX.search(line)
+        if match is None:
+            self.skipped += 1
+            return []
+        epoch, timestamp = self.parse_timestamp(match.group('timestamp'))
+        return self.add(match.group('client_ip'), epoch, timestamp, match.group('path'))
+
+    def add(self, client_ip: str, epoch: int, timestamp: datetime, request_path: str) -> List[IntervalStats]:
+        self.lines += 1
+        key = epoch - epoch % self.interval_seconds
+        if self._closed_until is not None and key < self._closed_until:
+            self.late += 1
+            return []
+        stats = self._open.get(key)
+        if stats is None:
+            offset = timedelta(seconds=epoch - key)
+            start = (timestamp - offset).replace(microsecond=0)
+            stats = self._open[key] = IntervalStats(start, start + timedelta(seconds=self.interval_seconds),
+                                                    self.tracked_segments)
+
+        counts = stats.counts
+        counts['total'] += 1
+        for segment in self.tracked_segments:
+            if segment in request_path:
+                counts[segment] += 1
+                break
+        else:
+            counts['other'] += 1
+
+        newer = self._newest is None or epoch > self._newest
+        if newer:
+            self._newest = epoch
+        state = stats.ips.get(client_ip)
+        if state is None:
+            stats.ips[client_ip] = [1, epoch, [epoch], None]
+        else:
+            recent = state[2]
+            if epoch >= recent[-1]:
+                gap = epoch - recent[-1]
+                recent.append(epoch)
+            else:
+                gap = _neighbour_gap(recent, epoch)
+                recent.insert(bisect_right(recent, epoch), epoch)
+                state[1] = min(state[1], epoch)
+            state[0] += 1
+            if state[3] is None or gap < state[3]:
+                state[3] = gap
+            # the newest epoch of the IP always stays, lines in order are measured against it
+            limit = self._newest - self.window
+            while recent[0] < limit and len(recent) > 1:
+                del recent[0]
+
+        if newer:
+            if self.grace is None:
+                return []
+            return self._close_before(epoch - self.grace - self.interval_seconds + 1)
+        return []
+
+    def _close_before(self, limit: int) -> List[IntervalStats]:
+        # an interval is done once the newest line is more than grace seconds past its end
+        closed = [key for key in self._open if key < limit]
+        if not closed:
+            return []
+        closed.sort()
+        self._closed_until = closed[-1] + self.interval_seconds
+        return [self._open.pop(key) for key in closed]
+
+    def close(self) -> List[IntervalStats]:
+        keys = sorted(self._open)
+        if keys:
+            self._closed_until = keys[-1] + self.interval_seconds
+        return [self._open.pop(key) for key in keys]
+
+
+def stream_intervals(lines: Iterable[str], aggregator: Optional[IntervalAggregator] = None,
+                     **options) -> Iterator[IntervalStats]:
+    """
+    Yield the IntervalStats of an access log in time order, each as soon as it is complete.
+    Pass an aggregator to read its counters (like `late`) afterwards.
+    """
+    if aggregator is None:
+        aggregator = IntervalAggregator(**options)
+    for line in lines:
+        closed = aggregator.add_line(line)
+        if closed:
+            yield from closed
+    yield from aggregator.close()
+
+
+CHUNK_BYTES = 32 * 1024 * 1024
+
+
+def expand_paths(patterns: Iterable[str]) -> List[str]:
+    """Paths of the files and glob patterns in the given order, each file once."""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise FileNotFoundError(f"No log file matches {pattern!r}")
+        for path in matches:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"No log file found at {path!r}")
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def plan_chunks(paths: Iterable[str], chunk_bytes: int = CHUNK_BYTES) -> List[Tuple[str, int, int]]:
+    """
+    (path, start, end) byte ranges of at most about chunk_bytes that start and end on a line
+    boundary. A .gz file is one range (0, -1), it can only be read from the start.
+    """
+    chunks = []
+    for path in paths:
+        if path.endswith('.gz'):
+            chunks.append((path, 0, -1))
+            continue
+        size = os.path.getsize(path)
+        if size == 0:
+            continue
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            while start < size:
+                newline = data.find(b'\n', min(start + chunk_bytes, size) - 1)
+                end = size if newline == -1 else newline + 1
+                chunks.append((path, start, end))
+                start = end
+    return chunks
+
+
+def analyze_chunk(path: str, start: int, end: int, **options) -> Dict[int, IntervalStats]:
+    """IntervalStats of the lines in a byte range of plan_chunks, by interval start epoch."""
+    # all intervals are returned at the end anyway, keeping them open places every line
+    options.setdefault('grace', None)
+    aggregator = IntervalAggregator(**options)
+    intervals = {}
+
+    def collect(closed):
+        for stats in closed:
+            intervals[int(stats.start.timestamp())] = stats
+
+    if end == -1:
+        with gzip.open(path, 'rt', encoding='utf-8') as lines:
+            for line in lines:
+                collect(aggregator.add_line(line))
+    else:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            text = data[start:end].decode('utf-8')
+        # split on '\n' only, like iterating over the file does
+        for line in text.split('\n'):
+            if line:
+                collect(aggregator.add_line(line))
+    collect(aggregator.close())
+    return intervals
+
+
+def _analyze_chunk(chunk: Tuple[str, int, int], options: dict) -> Dict[int, IntervalStats]:
+    return analyze_chunk(*chunk, **options)
+
+
+def merge_intervals(parts: Iterable[Dict[int, IntervalStats]]) -> List[IntervalStats]:
+    """
+    Merge the results of analyze_chunk into one IntervalStats per interval, in time order.
+    Parts of an interval are merged by the time of their first request and then in the given
+    order, so the result does not depend on which worker finished first.
+    """
+    pieces = {}
+    for index, part in enumerate(parts):
+        for key, stats in part.items():
+            first = min((state[1] for state in stats.ips.values()), default=key)
+            pieces.setdefault(key, []).append((first, index, stats))
+    merged = []
+    for key in sorted(pieces):
+        ordered = [stats for _, _, stats in sorted(pieces[key], key=lambda piece: piece[:2])]
+        total = ordered[0]
+        for stats in ordered[1:]:
+            total.merge(stats)
+        merged.append(total)
+    return merged
+
+
+def analyze_files(paths: Iterable[str], workers: Optional[int] = None, chunk_bytes: int = CHUNK_BYTES,
+                  **options) -> List[IntervalStats]:
+    """IntervalStats of all lines of the log files, chunks are read by a pool of worker processes."""
+    chunks = plan_chunks(paths, chunk_bytes)
+    workers = min(workers or os.cpu_count() or 1, len(chunks) or 1)
+    if workers == 1:
+        return merge_intervals(analyze_chunk(*chunk, **options) for chunk in chunks)
+    with ProcessPoolExecutor(workers) as executor:
+        # map keeps the order of the chunks
+        return merge_intervals(executor.map(_analyze_chunk, chunks, [options] * len(chunks)))
+
+
+def format_interval(stats: IntervalStats, top: int = 10) -> str:
+    """The summary of one interval the way explore-logs.py prints it."""
+    counts = stats.counts
+    lines = [
+        f"{stats.start.strftime('%H:%M')}–{stats.end.strftime('%H:%M')}",
+        f"  Total requests:    {counts['total']}",
+        f"  '/transcripts':    {counts['/transcripts']}",
+        f"  '/valuation':      {counts['/valuation']}",
+        f"  Other paths:       {counts['other']}",
+    ]
+    top_ips = stats.top_ips(top)
+    if top_ips:
+        lines.append(f"  Top {top} client IPs:")
+        for ip_address, request_count, shortest_gap in top_ips:
+            gap_text = f"{shortest_gap}s" if shortest_gap is not None else "N/A"
+            lines.append(f"    • {ip_address}: {request_count} requests, shortest interval {gap_text}")
+    return '\n'.join(lines) + '\n'
+
+
+def interval_minutes(text: str) -> int:
+    """argparse type of the --interval options, a whole number of minutes above zero."""
+    try:
+        minutes = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid interval {text!r}, expected whole minutes") from None
+    if minutes < 1:
+        raise argparse.ArgumentTypeError(f"interval must be at least 1 minute, got {minutes}")
+    return minutes
@@ -16,54 +16,9 @@ from collections import Counter
 from pathlib import Path
 
 # ────────────────────────────────────────────────────────────
-# Your original function (verbatim)
+# The classifier (signatures compiled once, verdicts cached per User-Agent)
 # ────────────────────────────────────────────────────────────
-def is_bot_request(request):
-    user_agent_string = request.META.get("HTTP_USER_AGENT", "").lower().strip()
-
-    bot_keyword_signatures = [
-        # ── Generic crawler verbs ──
-        "bot", "crawl", "spider", "slurp", "reader", "fetch",
-        "monitor", "analyzer", "healthcheck",
-
-        # ── Programming languages / HTTP libraries ──
-        "python", "requests", "urllib", "java",
-        "okhttp", "curl", "wget", "libwww",
-        "httpclient", "go-http-client", "axios",
-        "got", "postman", "insomnia",
-
-        # ── Headless browsers / testing tools ──
-        "headlesschrome", "phantomjs", "puppeteer",
-        "playwright", "selenium", "chromedp",
-        "lighthouse", "pagespeed",
-
-        # ── Major search / SEO crawlers (roots without “bot”) ──
-        "ahrefs", "semrush", "yandex",
-
-        # ── AI / LLM harvesters (roots without “bot”) ──
-        "openai", "chatgpt", "oai-search", "perplexity",
-        "googleother", "google-read-aloud",
-
-        # ── Social-media link fetchers lacking “bot” ──
-        "facebookexternalhit", "embedly", "whatsapp",
-
-        # ── Uptime & infrastructure monitors ──
-        "pingdom", "statuscake",
-
-        # ── Misc keywords you already use ──
-        "support", "feed", "spreadsheet", "script", "about",
-    ]
-
-    # Blank or missing User-Agent almost always means “bot”.
-    if not user_agent_string or user_agent_string == "-":
-        return True
-
-    for bot_signature in bot_keyword_signatures:
-        if bot_signature in user_agent_string:
-            return True
-
-    # Otherwise, looks like a human browser.
-    return False
+from bot_classifier import bot_classifier, is_bot_request
 
 
 # ────────────────────────────────────────────────────────────
@@ -106,6 +61,8 @@ def main():
         raise SystemExit("⚠️  access.log not found in the current directory.")
 
     human_lines, bot_lines = [], []
+    # the User-Agent of each classified line, so it is extracted only once
+    human_uas, bot_uas = [], []
     ua_counter = Counter()
 
     with log_path.open(encoding="utf-8", errors="replace") as fh:
@@ -116,8 +73,10 @@ def main():
             dummy_request = DummyRequest(ua)
             if is_bot_request(dummy_request):
                 bot_lines.append(line.rstrip())
+                bot_uas.append(ua)
             else:
                 human_lines.append(line.rstrip())
+                human_uas.append(ua)
 
     # ── Report ───────────────────────────────────────────────
     total = len(bot_lines) + len(human_lines)
@@ -140,11 +99,7 @@ def main():
     show_sample("✅ Human-like requests", human_lines)
 
     # ── Top 100 bot UAs only ─────────────────────────────────
-    bot_ua_counter = Counter()
-    for line in bot_lines:
-        ua = extract_user_agent(line)
-        if ua:  # skip blank strings
-            bot_ua_counter[ua] += 1
+    bot_ua_counter = Counter(ua for ua in bot_uas if ua)  # skip blank strings
 
     print("Top 100 Bot User-Agents by frequency")
     print("------------------------------------")
@@ -153,17 +108,21 @@ def main():
 
 
     # ── Top 100 Human UAs only ───────────────────────────────
-    human_ua_counter = Counter()
-    for line in human_lines:
-        ua = extract_user_agent(line)
-        if ua:  # skip blank strings
-            human_ua_counter[ua] += 1
+    human_ua_counter = Counter(ua for ua in human_uas if ua)  # skip blank strings
 
     print("Top 100 Human User-Agents by frequency")
     print("---------------------------------------")
     for ua, count in human_ua_counter.most_common(100):
         print(f"{count:>6} × {ua}")
 
+    # ── Signatures that matched ──────────────────────────────
+    signature_counter = Counter(bot_classifier.classify(ua) for ua in bot_uas)
+    print("\nMatched signatures")
+    print("------------------")
+    for signature, count in signature_counter.most_common():
+        print(f"{count:>6} × {signature}")
+    print(f"\n{bot_classifier.cache_info()}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,98 @@
+import os
+from collections import namedtuple
+
+from final import FMP_API, async_api_get, get_urls
+
+# functions the provider can answer for many tickers in one request, e.g. /v3/quote/AAPL,MSFT
+BATCH_ENDPOINTS = {
+    'get_quote': '/v3/quote/',
+    'get_profile': '/v3/profile/',
+}
+# tickers per batched request, FMP truncates very long symbol lists
+BATCH_SIZE = int(os.environ.get('FETCH_BATCH_SIZE', 100))
+
+# One request of a plan:
+#   url     - url to fetch
+#   tickers - tickers answered by it, None when it is a single ticker (or ticker independent) request
+Request = namedtuple('Request', ['url', 'tickers'])
+
+
+class FetchPlan:
+    """
+    Deduplicated requests for many (ticker, functions) jobs.
+
+    Ticker independent urls such as the treasury rates are fetched once, quote and profile are
+    fetched with comma separated tickers. split() turns the responses back into the list
+    get_urls(functions, ticker) would have produced for every job.
+    """
+
+    def __init__(self, jobs, batch_size=BATCH_SIZE):
+        jobs = [(ticker.upper(), functions) for ticker, functions in jobs]
+        self.requests = []
+        self._indexes = {}
+
+        # (function, ticker) -> index of the batched request answering it
+        batched = {}
+        for function, endpoint in BATCH_ENDPOINTS.items():
+            tickers = list(dict.fromkeys(ticker for ticker, functions in jobs if function in functions))
+            for start in range(0, len(tickers), batch_size):
+                chunk = tickers[start:start + batch_size]
+                url = FMP_API + endpoint + ','.join(chunk) + "?apikey=" + os.environ.get('FMP_KEY', '')
+                index = self._add(url, chunk)
+                for ticker in chunk:
+                    batched[function, ticker] = index
+
+        # job index -> [(request index, ticker to pick from a batched response or None), ...]
+        self.slots = []
+        for ticker, functions in jobs:
+            slots = []
+            for function in functions:
+                if (function, ticker) in batched:
+                    slots.append((batched[function, ticker], ticker))
+                else:
+                    # unknown functions have no url, same as in get_urls
+                    slots.extend((self._add(url, None), None) for url in get_urls([function], ticker))
+            self.slots.append(slots)
+
+    def _add(self, url, tickers):
+        index = self._indexes.get(url)
+        if index is None:
+            index = self._indexes[url] = len(self.requests)
+            self.requests.append(Request(url, tickers))
+        return index
+
+    @property
+    def urls(self):
+        return [request.url for request in self.requests]
+
+    def split(self, responses):
+        """Per job response lists, in the order of the job functions."""
+        by_symbol = {}
+        for index, request in enumerate(self.requests):
+            if request.tickers is not None:
+                rows = {}
+                for row in responses[index] if isinstance(responses[index], list) else []:
+                    rows.setdefault(str(row.get('symbol', '')).upper(), []).append(row)
+                by_symbol[index] = rows
+        # a batched request answers with the same list shape as a single ticker one
+        return [[by_symbol[index].get(ticker, []) if ticker is not None else responses[index]
+                 for index, ticker in slots]
+                for slots in self.slots]
+
+
+async def fetch_jobs(jobs, batch_size=BATCH_SIZE, fetch=async_api_get):
+    """Fetch the data of every (ticker, functions) job with as few requests as possible."""
+    plan = FetchPlan(jobs, batch_size)
+    responses = await fetch(plan.urls)
+    return plan.split(responses)
+
+
+if __name__ == "__main__":
+    import sys
+
+    tickers = sys.argv[1:] or ['AAPL', 'MSFT', 'GOOG']
+    functions = ['get_quote', 'get_profile', 'get_income_statement', 'get_treasury']
+    plan = FetchPlan([(ticker, functions) for ticker in tickers])
+    print(f"{len(tickers) * len(functions)} requests planned as {len(plan.requests)}")
+    for url in plan.urls:
+        print(url)
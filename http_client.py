@@ -0,0 +1,157 @@
+import asyncio
+import json
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ApiError(aiohttp.ClientError):
+    def __init__(self, url, status, body):
+        super().__init__(f"{url} returned {status}: {str(body)[:200]}")
+        self.status = status
+        self.body = body
+
+
+class TokenBucket:
+    """Allows rate requests per second on average with bursts of up to capacity requests."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    async def acquire(self):
+        while True:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ApiClient:
+    """
+    Shared HTTP client for the data providers.
+
+    Keeps one connection pool for the life of the event loop, caps the number of requests in
+    flight per host, spaces requests with a token bucket per host (FMP quota) and retries 429
+    and 5xx responses with jittered exponential backoff. When several processes fetch at the
+    same time each of them gets its share of the rate limits, see share().
+    """
+
+    def __init__(self, host_concurrency=10, concurrency=None, rate_limits=None, max_retries=4,
+                 backoff=0.5, max_backoff=30.0, timeout=30.0, processes=1):
+        self.host_concurrency = host_concurrency
+        self.concurrency = concurrency
+        # host -> requests per second, for all the processes together
+        self.rate_limits = rate_limits or {}
+        self.processes = processes
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.requests = 0
+        self.retries = 0
+        self._buckets = {}
+        self._loop = None
+        # aiohttp sessions belong to the event loop they were made on, by loop until close()
+        self._sessions = {}
+        self._semaphores = {}
+
+    def share(self, processes):
+        """Limit this process to its part of the rate limits, for `processes` processes fetching at once."""
+        self.processes = processes
+        self._buckets = {}
+
+    def _host_state(self, host):
+        # semaphores belong to one event loop too, start over on a new loop
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphores = {}
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency or 0, limit_per_host=self.host_concurrency,
+                                             ttl_dns_cache=300)
+            session = self._sessions[loop] = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._semaphores[host] = asyncio.Semaphore(self.host_concurrency)
+        bucket = self._buckets.get(host)
+        if bucket is None and host in self.rate_limits:
+            bucket = self._buckets[host] = TokenBucket(self.rate_limits[host] / self.processes)
+        return session, semaphore, bucket
+
+    def _delay(self, attempt, response=None):
+        if response is not None and response.status == 429:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(self.max_backoff, float(retry_after)) + random.uniform(0, self.backoff)
+        # full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def get(self, url):
+        """GET url and return (status, parsed JSON body)."""
+        host = urlsplit(url).hostname
+        session, semaphore, bucket = self._host_state(host)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                await bucket.acquire()
+            try:
+                async with semaphore:
+                    self.requests += 1
+                    # use GET instead of POST
+                    async with session.get(url) as response:
+                        text = await response.text()
+                        if response.status in RETRY_STATUSES and attempt >= self.max_retries:
+                            raise ApiError(url, response.status, text)
+                        if response.status not in RETRY_STATUSES:
+                            return response.status, json.loads(text)
+                        delay = self._delay(attempt, response)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._delay(attempt)
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def get_json(self, url):
+        """Parsed body of a successful response, raises on any other status."""
+        status, body = await self.get(url)
+        if status != 200:
+            raise ApiError(url, status, body)
+        return body
+
+    async def close(self):
+        """
+        Close the sessions of the running loop and of the loops that were closed since. A session
+        of another loop that is still open is kept, it can only be closed on that loop.
+        """
+        loop = asyncio.get_running_loop()
+        for session_loop, session in list(self._sessions.items()):
+            if session_loop is loop or session_loop.is_closed():
+                # on a closed loop the connections went with it, this only releases the session
+                del self._sessions[session_loop]
+                if not session.closed:
+                    await session.close()
+
+
+def _rate_limits():
+    # FMP_RATE_LIMIT is the plan quota in requests per minute
+    return {urlsplit(os.environ.get('FMP_API', 'https://financialmodelingprep.com/api')).hostname:
+            float(os.environ.get('FMP_RATE_LIMIT', 300)) / 60}
+
+
+# shared by every fetch of the process
+api_client = ApiClient(host_concurrency=int(os.environ.get('API_HOST_CONCURRENCY', 10)), rate_limits=_rate_limits())
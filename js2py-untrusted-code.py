@@ -1,36 +1,4 @@
-import js2py
-import errno
-import os
-import signal
-import functools
-
-class TimeoutError(Exception):
-    pass
-
-def timeout(seconds=10, error_message=os.strerror(errno.ETIME)):
-    def decorator(func):
-        def _handle_timeout(signum, frame):
-            raise TimeoutError(error_message)
-
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            signal.signal(signal.SIGALRM, _handle_timeout)
-            signal.alarm(seconds)
-            try:
-                result = func(*args, **kwargs)
-            finally:
-                signal.alarm(0)
-            return result
-
-        return wrapper
-
-    return decorator
-
-
-# Timeout after 5 seconds
-@timeout(5)
-def long_running_function2(js_string):
-    js2py.eval_js(js_string)
+from sandbox import SandboxPool, SandboxStepLimit, SandboxTimeout
 
 x = 2
 
@@ -41,5 +9,11 @@ js_string = """
 
 #context = js2py.EvalJs({'_input_params': _input_params})
 # js2py.eval_js(js_string)
-long_running_function2(js_string)
+# runs in a pre-forked worker with a step budget (SANDBOX_STEPS), a 5 second CPU budget and a
+# memory limit, the worker is replaced when it goes over
+with SandboxPool(workers=1, timeout=5) as pool:
+    try:
+        pool.evaluate(js_string, [])
+    except (SandboxStepLimit, SandboxTimeout) as e:
+        print(e)
 print(x)
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import js2py
+
+from profiling import instrument_calls, profiler
+from step_budget import STEP_HOOK, instrument
+
+
+class ModelCache:
+    """
+    LRU cache of valuation scripts already translated by js2py.
+
+    js2py spends most of a run parsing the JS and translating it to Python, so the
+    translated code object is kept per source hash and executed against a fresh
+    EvalJs scope that only holds the per-run data (income, quote, _input_params, ...).
+    Runs with a step budget use a second translation that counts loop iterations and calls,
+    with profiling on every function of the translation is also timed.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(source):
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def get(self, source, budgeted=False):
+        """Return the compiled code object for source, translating it on a miss."""
+        key = self.key(source) + ('-steps' if budgeted else '') + ('-profile' if profiler.enabled else '')
+        with self._lock:
+            compiled = self._compiled.get(key)
+            if compiled is not None:
+                self._compiled.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        # translate outside of the lock, this is the slow part
+        with profiler.stage('translate', key[:12]):
+            code = js2py.translate_js(source, '')
+            if budgeted:
+                code = instrument(code)
+            if profiler.enabled:
+                code = instrument_calls(code)
+            compiled = compile(code, '<valuation ' + key[:12] + '>', 'exec')
+
+        with self._lock:
+            self._compiled[key] = compiled
+            while len(self._compiled) > self.maxsize:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def execute(self, source, context, budget=None):
+        """Run source in a new scope built from context and return that scope, budget is a StepBudget."""
+        compiled = self.get(source, budgeted=budget is not None)
+        with profiler.stage('execute', self.key(source)[:12] if profiler.enabled else ''):
+            scope = js2py.EvalJs(context)
+            if budget is not None:
+                scope.context[STEP_HOOK] = budget.tick
+            if profiler.enabled:
+                profiler.install(scope.context)
+            exec(compiled, scope.context)
+        return scope
+
+    def clear(self):
+        with self._lock:
+            self._compiled.clear()
+
+    def __len__(self):
+        return len(self._compiled)
+
+    def __contains__(self, source):
+        return self.key(source) in self._compiled
+
+
+# shared per-process cache, size can be tuned with MODEL_CACHE_SIZE
+model_cache = ModelCache(int(os.environ.get('MODEL_CACHE_SIZE', 64)))
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Asynchronous valuation pipeline: fetch -> preprocess -> execute, with js2py off the event loop.
+
+    python pipeline.py code.txt tickers.txt -o valuations.jsonl -j 4 --fetchers 8
+
+Tickers are fetched by a few concurrent fetchers while earlier tickers are being valued on an
+executor, bounded queues between the stages hold the fetchers back when the execution falls
+behind (and the execution back when the consumer does). From Python:
+
+    async for result in valuations(raw_model, tickers):
+        ...
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from batch import fetch, init_worker, load_model, model_functions, read_tickers, value_ticker
+from final import get_urls, parse_input_params
+from http_client import api_client
+from preprocessor import parse_model
+
+
+async def valuations(raw_model, tickers, executor='process', workers=None, fetchers=8, queue_size=16,
+                     input_params=None, keep_logs=False, run=value_ticker):
+    """
+    Async iterator of the batch.py result dicts, in completion order.
+
+    executor is 'process' (default, runs on all cores), 'thread' (one interpreter, only the
+    network overlaps with js2py) or a concurrent.futures executor whose workers already ran
+    batch.init_worker for this model. run(ticker, responses) is what the executor calls, an
+    executor shared by several models gets a picklable run that carries the model itself.
+    At most queue_size fetched tickers wait for the executor.
+    """
+    # a broken model fails here instead of in every worker
+    functions = model_functions(parse_model(raw_model))
+    workers = workers or os.cpu_count() or 1
+    owned = None
+    if executor == 'process':
+        executor = owned = ProcessPoolExecutor(workers, initializer=init_worker,
+                                               initargs=(raw_model, input_params or {}, keep_logs))
+    elif executor == 'thread':
+        # value_ticker runs on the globals of batch, console output of parallel threads can mix
+        load_model(raw_model, input_params or {}, keep_logs)
+        executor = owned = ThreadPoolExecutor(workers)
+    loop = asyncio.get_running_loop()
+
+    pending = asyncio.Queue()
+    for ticker in tickers:
+        pending.put_nowait(ticker)
+    total = pending.qsize()
+    fetched = asyncio.Queue(queue_size)
+    results = asyncio.Queue(queue_size)
+
+    async def fetch_stage():
+        while not pending.empty():
+            ticker = pending.get_nowait()
+            started = time.perf_counter()
+            try:
+                responses, error = await fetch(get_urls(functions, ticker)), None
+            except Exception as e:
+                responses, error = None, f"{type(e).__name__}: {e}"
+            await fetched.put((ticker, responses, error, round((time.perf_counter() - started) * 1000, 3)))
+
+    async def execute_stage():
+        while True:
+            ticker, responses, error, fetch_ms = await fetched.get()
+            if error is None:
+                started = time.perf_counter()
+                try:
+                    result = await loop.run_in_executor(executor, run, ticker, responses)
+                except Exception as e:
+                    # a broken pool or an unpicklable result, the consumer still gets one result per ticker
+                    result = {'ticker': ticker, 'value': None, 'ccy': None, 'error': f"{type(e).__name__}: {e}",
+                              'run_ms': round((time.perf_counter() - started) * 1000, 3)}
+            else:
+                result = {'ticker': ticker, 'value': None, 'ccy': None, 'error': error, 'run_ms': None}
+            result['fetch_ms'] = fetch_ms
+            await results.put(result)
+
+    tasks = [asyncio.ensure_future(fetch_stage()) for _ in range(min(fetchers, total) or 1)]
+    tasks += [asyncio.ensure_future(execute_stage()) for _ in range(workers)]
+    try:
+        for _ in range(total):
+            yield await results.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if owned is not None:
+            owned.shutdown(cancel_futures=True)
+
+
+async def run_pipeline(raw_model, tickers, output, **options):
+    completed = 0
+    try:
+        async for result in valuations(raw_model, tickers, **options):
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            completed += 1
+    finally:
+        await api_client.close()
+    return completed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Value a list of tickers with fetching and js2py overlapped.")
+    parser.add_argument('model', help="valuation model file, e.g. code.txt")
+    parser.add_argument('tickers', help="file with one ticker per line, '-' for stdin")
+    parser.add_argument('-o', '--output', default='valuations.jsonl', help="JSON Lines output, '-' for stdout")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="executor workers")
+    parser.add_argument('--executor', choices=('process', 'thread'), default='process')
+    parser.add_argument('--fetchers', type=int, default=8, help="tickers fetched at the same time")
+    parser.add_argument('--queue-size', type=int, default=16, help="fetched tickers waiting for the executor")
+    parser.add_argument('--input', default='', help="input parameters, e.g. '#MIN=51&MAX=52'")
+    parser.add_argument('--logs', action='store_true', help="include the model console output in the results")
+    args = parser.parse_args()
+
+    with open(args.model, 'r') as f:
+        raw_model = f.read()
+    tickers = read_tickers(args.tickers)
+
+    started = time.perf_counter()
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    with output if output is not sys.stdout else contextlib.nullcontext():
+        completed = asyncio.run(run_pipeline(raw_model, tickers, output, executor=args.executor,
+                                             workers=args.workers, fetchers=args.fetchers,
+                                             queue_size=args.queue_size, input_params=parse_input_params(args.input),
+                                             keep_logs=args.logs))
+    elapsed = time.perf_counter() - started
+    print(f"{completed} valuations in {elapsed:.1f}s ({completed / elapsed:.1f}/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
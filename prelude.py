@@ -0,0 +1,279 @@
+import math
+import os
+
+from js2py.base import Js, MakeError, PyJsException, PyJsNumber, undefined
+
+from profiling import profiler, timed_helper
+from reports import statement_column
+from statements import as_array, numpy
+
+# Globals the functions below keep their state in
+base_globals = "var _return_value=0;var _return_ccy='';var _input_global={};var _chart_data_x_historic_lastDate;"
+
+# Functions every valuation model can rely on, the website defines the same ones
+base_functions = """
+    """ + base_globals + """
+    function monitor(context){return;}
+    function Description(text){return '';}
+    function _SetEstimatedValue(value, ccy){console.log("_SetEstimatedValue log: " + value + ccy); return;}
+    function _StopIfWatch(value, ccy){console.log("_StopIfWatch log: " + value + ' ' + ccy);_return_value=value;_return_ccy=ccy;return true;}
+    function print(str, label, type){console.log(str);return;}
+    function Input(original){if(_input_params){for(key in _input_params){original[key] = _input_params[key];}}for(key in original){if(key[0] == '_' && original[key] != '-' && typeof original[key] == 'number'){original[key] /= 100;}}_input_global=original;return _input_global;}
+    function setInputDefault(Key, Value){let roundedVal = Math.ceil(Value * 100) / 100;if(_input_params){for(param_key in _input_params){if(param_key == Key){return;}}}if(Key.charAt(0) == '_'){_input_global[Key] = roundedVal / 100;}else{_input_global[Key] = roundedVal;}}
+    function fillHistoricUsingReport(report, key, measure){_chart_data_x_historic_lastDate = parseInt(report[0]['date']);}
+    function fillHistoricUsingList(list, key, endingYear){_chart_data_x_historic_lastDate = parseInt(endingYear);}
+    function dateToIndex(date){if(_chart_data_x_historic_lastDate){return parseInt(date) - _chart_data_x_historic_lastDate - 1;}return -1;}
+    function forecast(list, key){if(_input_params){for(param_key in _input_params){if(param_key.charAt(0) == '!'){var indexOfParameter =  param_key.indexOf('_');if(key == param_key.substr(1, indexOfParameter - 1)){var listIndex = dateToIndex(param_key.substr(indexOfParameter + 1));if(listIndex != -1){list[listIndex] = Number(_input_params[param_key]);}}}}}return list;}
+    // -------------------------------------
+    // copy paste from valuation-functions.js
+    function toM(value){return value / 1000000;}
+    function toK(value){return value / 1000;}
+"""
+
+# Numeric helpers from valuation-functions.js, these have a native implementation below
+helper_functions = {
+    'addKey': "function addKey(key, report_from, report_to){for(var i = 0; i < report_from.length; i++){for(var j = 0; j < report_to.length; j++){if(report_from[i]['date'] == report_to[j]['date']){if(!(key in report_to[j])){report_to[j][key] = report_from[i][key];}if(i < report_from.length - 1){i++;}else{report_to = report_to.slice(0, j + 1);return report_to;}}}}return report_to;}",
+    'linearRegressionGrowthRate': "function linearRegressionGrowthRate(key, report, years, slope){var rep = report.slice();rep.reverse();var count = rep.length;var xSum=0, ySum=0, xxSum=0, xySum=0;var rate = 0;try{for(var i = 0; i < count; i++){xSum += i+1;ySum += rep[i][key];xxSum += (i+1) * (i+1);xySum += rep[i][key] * (i+1);}var slope = slope * (count * xySum - xSum * ySum) / (count * xxSum - xSum * xSum);var intercept = (ySum / count) - (slope * xSum) / count;var xValues = [];var yValues = [];for(var i = 0; i < count + years; i++){xValues.push(i+1);yValues.push((i+1) * slope + intercept);}return yValues;}catch(error){print(error, 'Error in linearRegressionGrowthRate');}}",
+    'getGrowthList': "function getGrowthList(report, key, length, rate){var growth_list = [];var lastValue = 0;if(report.length > 1){report[0][key];}else{lastValue = report[key];}for(var i = 1; i <= length; i++){growth_list.push(lastValue * Math.pow((1+rate), i));}return growth_list;}",
+    'applyMarginToList': "function applyMarginToList(list, margin){list.forEach(function(val, i){list[i] = val * margin;});return list;}",
+    'averageGrowthRate': "function averageGrowthRate(key, report){var rep = report.slice();rep.reverse();var val0 = rep[0][key];var val1;var rate = 0;try{for(var i = 1; i < rep.length; i++){val1 = rep[i][key];if(val0){rate += (val1 - val0)/val0;}val0 = val1;}rate /= rep.length - 1;return rate;}catch(error){print(error, 'Error in average_growth_rate');}}",
+    'averageMargin': "function averageMargin(key1, key2, report){var margin = 0;try{for(var i = 0; i < report.length; i++){margin += report[i][key1]/report[i][key2];}margin /= report.length;return margin;}catch(error){print(error, 'Error in average_margin');}}",
+    'replaceWithLTM': "function replaceWithLTM(report, ltm){for(var key in ltm){var value = ltm[key];if( typeof value == 'number' ){report[0][key] = ltm[key]}}return report;}",
+}
+
+# NATIVE_HELPERS=0 runs the JS versions of the helpers instead of the Python ones
+NATIVE_HELPERS = os.environ.get('NATIVE_HELPERS', '1') != '0'
+
+
+def get_prelude(native_helpers=NATIVE_HELPERS):
+    """JS prelude for a run, without the helpers that are provided natively."""
+    if native_helpers:
+        return base_functions
+    return base_functions + ''.join('    ' + source + '\n' for source in helper_functions.values())
+
+
+def install_native_helpers(context):
+    """Add the Python helpers to a context dict before it is turned into an EvalJs scope."""
+    context.update(profiled_native_helpers if profiler.enabled else native_helpers)
+    return context
+
+
+# The helpers below receive and return js2py values and follow the JS code above step by step,
+# so results are bit for bit the same. Values are read with JS ToNumber, string concatenation
+# done by `+` on non numeric fields is not reproduced.
+# They use the signature of js2py translated functions (..., this, arguments, var), otherwise
+# js2py rewrites their bytecode every time they are wrapped for a new scope.
+
+def _number(value):
+    if type(value) is PyJsNumber:
+        return value.value
+    return value.to_number().value
+
+
+def _length(array):
+    return _number(array.get('length'))
+
+
+def _rows(report, strict=True):
+    # report.slice() throws for anything that is not array like, a plain loop just does nothing
+    length = _length(report)
+    if length != length:
+        if not strict:
+            return []
+        raise MakeError('TypeError', 'report.slice is not a function')
+    return [report.get(str(i)) for i in range(int(length))]
+
+
+def _divide(dividend, divisor):
+    # JS division never raises
+    try:
+        return dividend / divisor
+    except ZeroDivisionError:
+        if dividend != dividend or dividend == 0:
+            return math.nan
+        return math.copysign(math.inf, dividend) * math.copysign(1.0, divisor)
+
+
+def _power(base, exponent):
+    # same as js2py's Math.pow, which gives NaN on overflow
+    if base != base or exponent != exponent:
+        return math.nan
+    try:
+        return base ** exponent
+    except (OverflowError, ZeroDivisionError):
+        return math.nan
+
+
+def _column(report, key):
+    # NumPy array of a statement field the model has not changed, for the vectorized paths
+    if numpy is None:
+        return None
+    column = statement_column(report, key.to_string().value)
+    return None if column is None else as_array(column)
+
+
+def _sequential_sum(values):
+    # cumsum adds left to right like the JS loops, sum() would round differently.
+    # Adding 0.0 reproduces the 0 the loops start from (0 + -0 is 0)
+    return 0.0 + numpy.cumsum(values)[-1] if len(values) else 0.0
+
+
+def _loose_equals(a, b):
+    if type(a) is type(b) and a.TYPE in ('String', 'Number'):
+        return a.value == b.value
+    return a.abstract_equality_comparison(b).value
+
+
+def add_key(key, report_from, report_to, this, arguments, var=None):
+    key = key.to_string().value
+    dates_from = [row.get('date') for row in _rows(report_from, strict=False)]
+    rows_to = _rows(report_to, strict=False)
+    dates_to = [row.get('date') for row in rows_to]
+    i = 0
+    while i < len(dates_from):
+        j = 0
+        while j < len(rows_to):
+            if _loose_equals(dates_from[i], dates_to[j]):
+                if not rows_to[j].has_property(key):
+                    rows_to[j].put(key, report_from.get(str(i)).get(key))
+                if i < len(dates_from) - 1:
+                    i += 1
+                else:
+                    return Js(rows_to[:j + 1])
+            j += 1
+        i += 1
+    return report_to
+
+
+def linear_regression_growth_rate(key, report, years, slope, this, arguments, var=None):
+    column = _column(report, key)
+    if column is not None:
+        values = column[::-1]
+        count = len(values)
+        x = numpy.arange(1, count + 1, dtype=numpy.float64)
+        # sums of small integers are exact in any order
+        x_sum = float(count * (count + 1) // 2)
+        xx_sum = float(count * (count + 1) * (2 * count + 1) // 6)
+        y_sum = _sequential_sum(values)
+        xy_sum = _sequential_sum(values * x)
+        return _regression_values(count, x_sum, y_sum, xx_sum, xy_sum, years, slope)
+
+    rows = _rows(report)
+    rows.reverse()
+    count = len(rows)
+    x_sum = y_sum = xx_sum = xy_sum = 0.0
+    try:
+        for i, row in enumerate(rows):
+            value = _number(row.get(key))
+            x_sum += i + 1
+            y_sum += value
+            xx_sum += (i + 1) * (i + 1)
+            xy_sum += value * (i + 1)
+    except PyJsException as error:
+        print(error)
+        return None
+    return _regression_values(count, x_sum, y_sum, xx_sum, xy_sum, years, slope)
+
+
+def _regression_values(count, x_sum, y_sum, xx_sum, xy_sum, years, slope):
+    try:
+        slope = _divide(_number(slope) * (count * xy_sum - x_sum * y_sum), count * xx_sum - x_sum * x_sum)
+        intercept = _divide(y_sum, count) - _divide(slope * x_sum, count)
+        y_values = []
+        i = 0
+        end = count + _number(years)
+        while i < end:
+            y_values.append((i + 1) * slope + intercept)
+            i += 1
+        return y_values
+    except PyJsException as error:
+        print(error)
+
+
+def get_growth_list(report, key, length, rate, this, arguments, var=None):
+    growth_list = []
+    last_value = 0.0
+    if not _length(report) > 1:
+        last_value = _number(report.get(key))
+    base = 1 + _number(rate)
+    length = _number(length)
+    i = 1
+    while i <= length:
+        growth_list.append(last_value * _power(base, i))
+        i += 1
+    return growth_list
+
+
+def apply_margin_to_list(values, margin, this, arguments, var=None):
+    margin = _number(margin)
+    for i in range(int(_length(values))):
+        if values.has_property(str(i)):
+            values.put(str(i), Js(_number(values.get(str(i))) * margin))
+    return values
+
+
+def average_growth_rate(key, report, this, arguments, var=None):
+    column = _column(report, key)
+    if column is not None and len(column):
+        values = column[::-1]
+        previous, current = values[:-1], values[1:]
+        # `if(val0)` skips zero and NaN
+        counted = (previous != 0) & ~numpy.isnan(previous)
+        with numpy.errstate(all='ignore'):
+            rates = (current[counted] - previous[counted]) / previous[counted]
+        return _divide(_sequential_sum(rates), len(values) - 1)
+
+    rows = _rows(report)
+    rows.reverse()
+    value0 = (rows[0] if rows else undefined).get(key)
+    rate = 0.0
+    try:
+        for row in rows[1:]:
+            value1 = row.get(key)
+            if value0.to_boolean().value:
+                rate += _divide(_number(value1) - _number(value0), _number(value0))
+            value0 = value1
+        return _divide(rate, len(rows) - 1)
+    except PyJsException as error:
+        print(error)
+
+
+def average_margin(key1, key2, report, this, arguments, var=None):
+    numerators, denominators = _column(report, key1), _column(report, key2)
+    if numerators is not None and denominators is not None:
+        with numpy.errstate(all='ignore'):
+            margins = numerators / denominators
+        return _divide(_sequential_sum(margins), len(margins))
+
+    margin = 0.0
+    try:
+        count = _length(report)
+        i = 0
+        while i < count:
+            row = report.get(str(i))
+            margin += _divide(_number(row.get(key1)), _number(row.get(key2)))
+            i += 1
+        return _divide(margin, count)
+    except PyJsException as error:
+        print(error)
+
+
+def replace_with_ltm(report, ltm, this, arguments, var=None):
+    for key in ltm:
+        value = ltm.get(key)
+        if value.TYPE == 'Number':
+            report.get('0').put(key, value)
+    return report
+
+
+native_helpers = {
+    'addKey': add_key,
+    'linearRegressionGrowthRate': linear_regression_growth_rate,
+    'getGrowthList': get_growth_list,
+    'applyMarginToList': apply_margin_to_list,
+    'averageGrowthRate': average_growth_rate,
+    'averageMargin': average_margin,
+    'replaceWithLTM': replace_with_ltm,
+}
+# same helpers counted and timed by the profiler
+profiled_native_helpers = {name: timed_helper(name, function) for name, function in native_helpers.items()}
@@ -0,0 +1,354 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+from profiling import profiler
+
+# Structured result of reading a raw valuation model once:
+#   when_calls         - [(function_name, [argument source, ...]), ...] from $.when(...)
+#   done_parameters    - parameter names of the function passed to .done(...)
+#   source             - model rewritten for js2py (.done callback turned into _when_done)
+#   description_ranges - (start, end) offsets in the raw model of stripped Description(...) arguments
+ModelSpec = namedtuple('ModelSpec', ['when_calls', 'done_parameters', 'source', 'description_ranges'])
+
+# Only what matters for the rewrite is tokenized: brackets, separators, literals and the
+# $.when / Description markers. Searching for their first character is a single charset scan in
+# the regex engine, names, numbers, operators and whitespace never reach Python code.
+_SCAN_START = re.compile(r'[()\[\]{},;/"\'`$D]')
+_COMMENT_REGEX = re.compile(r'//[^\n]*|/\*.*?\*/', re.DOTALL)
+_STRING_REGEX = {
+    '"': re.compile(r'"(?:[^"\\\n]|\\.)*"', re.DOTALL),
+    "'": re.compile(r"'(?:[^'\\\n]|\\.)*'", re.DOTALL),
+}
+_WHEN_REGEX = re.compile(r'\$\s*\.\s*when(?![\w$])')
+_DESCRIPTION_REGEX = re.compile(r'Description(?![\w$])')
+_NAME_CHARACTERS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$.')
+
+_DONE_REGEX = re.compile(r'\s*\.\s*done\s*\(\s*function(?:\s+[\w$]+)?\s*$')
+_NAME_REGEX = re.compile(r'\s*([\w$]+)')
+_REGEX_FLAGS = re.compile(r'[A-Za-z]*')
+_WORD_BEFORE = re.compile(r'[\w$]+$')
+
+# after these a '/' starts a regular expression literal instead of a division
+_REGEX_PREFIX_KEYWORDS = {'return', 'typeof', 'case', 'in', 'of', 'new', 'delete', 'void', 'instanceof', 'throw', 'else', 'do'}
+
+_OPENING = {'(': ')', '[': ']', '{': '}'}
+_CLOSING = {')', ']', '}'}
+
+
+class ModelSyntaxError(ValueError):
+    pass
+
+
+def scan(source, pos=0, stop_at_closing_brace=False):
+    """
+    Return the (kind, start, end) tokens of source that the preprocessor cares about.
+    kind is the bracket/separator character itself, or 'string', 'template', 'regex', 'when'
+    and 'description'. Comments are dropped. With stop_at_closing_brace the scan ends at the
+    first unbalanced '}' (used for template ${...} substitutions) and also returns its offset.
+    """
+    tokens = []
+    depth = 0
+    search = _SCAN_START.search
+    while True:
+        match = search(source, pos)
+        if match is None:
+            break
+        start = match.start()
+        char = source[start]
+        end = start + 1
+        if char in '"\'':
+            string = _STRING_REGEX[char].match(source, start)
+            if string is None:
+                raise ModelSyntaxError(f"Unterminated string at offset {start}")
+            kind, end = 'string', string.end()
+        elif char == '`':
+            kind, end = 'template', _template_parts(source, start)[1]
+        elif char == '/':
+            comment = _COMMENT_REGEX.match(source, start)
+            if comment is not None:
+                pos = comment.end()
+                continue
+            if not _starts_regex(source, start):
+                pos = end
+                continue
+            kind, end = 'regex', _regex_end(source, start)
+        elif char == '$' or char == 'D':
+            marker = (_WHEN_REGEX if char == '$' else _DESCRIPTION_REGEX).match(source, start)
+            if marker is None or (start and source[start - 1] in _NAME_CHARACTERS):
+                pos = end
+                continue
+            kind, end = ('when' if char == '$' else 'description'), marker.end()
+        else:
+            kind = char
+            if stop_at_closing_brace:
+                if kind == '{':
+                    depth += 1
+                elif kind == '}':
+                    if depth == 0:
+                        return tokens, start
+                    depth -= 1
+        tokens.append((kind, start, end))
+        pos = end
+    if stop_at_closing_brace:
+        raise ModelSyntaxError("Unterminated template substitution")
+    return tokens
+
+
+def _text_before(source, pos):
+    return source[max(0, pos - 64):pos].rstrip()
+
+
+def _starts_regex(source, pos):
+    # decide between division and a regular expression from the previous significant character
+    before = _text_before(source, pos)
+    if not before:
+        return True
+    last = before[-1]
+    if last in ')]}"\'`':
+        return False
+    if before.endswith(('++', '--')):
+        # x++ / 2, a prefix ++ or -- cannot be followed by a regular expression
+        return False
+    if last.isalnum() or last in '_$':
+        return _WORD_BEFORE.search(before).group() in _REGEX_PREFIX_KEYWORDS
+    return True
+
+
+def _regex_end(source, pos):
+    in_class = False
+    i = pos + 1
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '\n':
+            break
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            return _REGEX_FLAGS.match(source, i + 1).end()
+        i += 1
+    raise ModelSyntaxError(f"Unterminated regular expression at offset {pos}")
+
+
+def _template_parts(source, pos):
+    """Return ([('text', str) | ('expr', str), ...], end) for the template literal at pos."""
+    parts = []
+    i = pos + 1
+    text_start = i
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+        elif char == '`':
+            parts.append(('text', source[text_start:i]))
+            return parts, i + 1
+        elif source.startswith('${', i):
+            parts.append(('text', source[text_start:i]))
+            _, close = scan(source, i + 2, stop_at_closing_brace=True)
+            parts.append(('expr', source[i + 2:close]))
+            i = text_start = close + 1
+        else:
+            i += 1
+    raise ModelSyntaxError(f"Unterminated template literal at offset {pos}")
+
+
+def template_to_es5(template):
+    """js2py only understands ES5, rewrite `a ${b} c` as ("a " + (b) + " c")."""
+    parts, _ = _template_parts(template, 0)
+    pieces = []
+    for kind, text in parts:
+        if kind == 'expr':
+            # not parse_model, its cache is for whole models
+            pieces.append('(' + _parse_model(text).source + ')')
+        elif text or not pieces:
+            pieces.append('"' + _TEMPLATE_TEXT_REGEX.sub(_escape_template_text, text) + '"')
+    if len(pieces) == 1:
+        return pieces[0]
+    return '(' + ' + '.join(pieces) + ')'
+
+
+_TEMPLATE_TEXT_REGEX = re.compile(r'\\.|["\n\r]', re.DOTALL)
+_TEMPLATE_TEXT_ESCAPES = {'\\`': '`', '\\$': '$', '"': '\\"', '\n': '\\n', '\r': '\\r'}
+
+
+def _escape_template_text(match):
+    # template escapes are string escapes, only \` \$ and raw quotes/newlines need translating
+    return _TEMPLATE_TEXT_ESCAPES.get(match.group(), match.group())
+
+
+def _matching(tokens, index):
+    """Index of the token closing the bracket at tokens[index]."""
+    opening = tokens[index][0]
+    closing = _OPENING[opening]
+    depth = 0
+    for i in range(index, len(tokens)):
+        kind = tokens[i][0]
+        if kind == opening:
+            depth += 1
+        elif kind == closing:
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ModelSyntaxError(f"Unbalanced {opening!r} at offset {tokens[index][1]}")
+
+
+def _expect(tokens, index, kind):
+    if index >= len(tokens) or tokens[index][0] != kind:
+        found = tokens[index][0] if index < len(tokens) else 'end of model'
+        raise ModelSyntaxError(f"Expected {kind!r} but found {found!r}")
+    return index
+
+
+def _split_arguments(source, tokens, open_index, close_index):
+    """Source text of the top level comma separated arguments between two brackets."""
+    arguments = []
+    depth = 0
+    start = tokens[open_index][2]
+    for i in range(open_index + 1, close_index):
+        kind, token_start, token_end = tokens[i]
+        if kind in _OPENING:
+            depth += 1
+        elif kind in _CLOSING:
+            depth -= 1
+        elif kind == ',' and depth == 0:
+            arguments.append(source[start:token_start].strip())
+            start = token_end
+    arguments.append(source[start:tokens[close_index][1]].strip())
+    return [argument for argument in arguments if argument]
+
+
+def _parse_when_call(source, tokens, start_index, end_index):
+    """get_treasury_monthly(30) -> ('get_treasury_monthly', ['30'])"""
+    name = _NAME_REGEX.match(source, tokens[start_index][2])
+    if name is None:
+        raise ModelSyntaxError(f"Expected a function call in $.when at offset {tokens[start_index][2]}")
+    for i in range(start_index + 1, end_index):
+        if tokens[i][0] == '(':
+            return name.group(1), _split_arguments(source, tokens, i, _matching(tokens, i))
+    return name.group(1), []
+
+
+def _parse_when(source, tokens, index):
+    """
+    Parse $.when(...).done(function(...){ from the 'when' token at index.
+    Returns (when_calls, done_parameters, index of '{', index of '}', index after ');').
+    """
+    open_when = _expect(tokens, index + 1, '(')
+    close_when = _matching(tokens, open_when)
+
+    when_calls = []
+    argument_start = open_when
+    depth = 0
+    for i in range(open_when + 1, close_when + 1):
+        kind = tokens[i][0]
+        if (kind == ',' and depth == 0) or i == close_when:
+            if source[tokens[argument_start][2]:tokens[i][1]].strip():
+                when_calls.append(_parse_when_call(source, tokens, argument_start, i))
+            argument_start = i
+        elif kind in _OPENING:
+            depth += 1
+        elif kind in _CLOSING:
+            depth -= 1
+
+    open_done = _expect(tokens, close_when + 1, '(')
+    open_params = _expect(tokens, open_done + 1, '(')
+    if not _DONE_REGEX.match(source[tokens[close_when][2]:tokens[open_params][1]]):
+        raise ModelSyntaxError(f"Expected .done(function(...){{ after $.when at offset {tokens[index][1]}")
+    close_params = _matching(tokens, open_params)
+    done_parameters = _split_arguments(source, tokens, open_params, close_params)
+
+    open_body = _expect(tokens, close_params + 1, '{')
+    close_body = _matching(tokens, open_body)
+    close_done = _expect(tokens, close_body + 1, ')')
+    if close_done != _matching(tokens, open_done):
+        raise ModelSyntaxError("Unexpected arguments after the .done() callback")
+    end_of_call = close_done + 1
+    if end_of_call < len(tokens) and tokens[end_of_call][0] == ';':
+        end_of_call += 1
+    return when_calls, done_parameters, open_body, close_body, end_of_call
+
+
+# parsed models by source hash, a valuation asks for its model several times
+_parsed = OrderedDict()
+_parsed_lock = threading.Lock()
+_PARSED_SIZE = 64
+
+
+def parse_model(source):
+    """
+    Read the raw valuation model once and return its ModelSpec, shared by the callers of the
+    same source so its lists must not be changed.
+
+    $.when(get_x(), ...).done(function(x, ...){ body }); becomes function _when_done(){ body },
+    Description(...) arguments become '' and the remaining template literals become ES5 strings.
+    """
+    key = hashlib.sha256(source.encode('utf-8')).hexdigest()
+    with _parsed_lock:
+        model = _parsed.get(key)
+        if model is not None:
+            _parsed.move_to_end(key)
+            return model
+    with profiler.stage('preprocess'):
+        model = _parse_model(source)
+    with _parsed_lock:
+        _parsed[key] = model
+        while len(_parsed) > _PARSED_SIZE:
+            _parsed.popitem(last=False)
+    return model
+
+
+def _parse_model(source):
+    tokens = scan(source)
+    when_calls = []
+    done_parameters = []
+    description_ranges = []
+    pieces = []
+    copied_until = 0
+    # token index of the '}' closing the .done callback and of the token after its ');'
+    close_body = end_of_call = None
+
+    i = 0
+    while i < len(tokens):
+        kind, start, end = tokens[i]
+        if kind == 'when' and close_body is None:
+            when_calls, done_parameters, open_body, close_body, end_of_call = _parse_when(source, tokens, i)
+            pieces.append(source[copied_until:start])
+            pieces.append('function _when_done(){')
+            copied_until = tokens[open_body][2]
+            # the callback body is scanned like the rest of the model
+            i = open_body + 1
+            continue
+
+        if i == close_body:
+            pieces.append(source[copied_until:end])
+            copied_until = tokens[end_of_call - 1][2]
+            i = end_of_call
+            continue
+
+        if (kind == 'description' and i + 1 < len(tokens) and tokens[i + 1][0] == '('
+                and not _text_before(source, start).endswith('function')):
+            close = _matching(tokens, i + 1)
+            argument_start, argument_end = tokens[i + 1][2], tokens[close][1]
+            description_ranges.append((argument_start, argument_end))
+            pieces.append(source[copied_until:argument_start])
+            pieces.append("''")
+            copied_until = argument_end
+            i = close
+        elif kind == 'template':
+            pieces.append(source[copied_until:start])
+            pieces.append(template_to_es5(source[start:end]))
+            copied_until = end
+        i += 1
+
+    pieces.append(source[copied_until:])
+    return ModelSpec(when_calls, done_parameters, ''.join(pieces), description_ranges)
+
+
+def format_raw_model(source):
+    return parse_model(source).source
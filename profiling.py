@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Opt-in profiling of valuation runs: wall and CPU time per stage (fetch, preprocess, translate,
+context, execute) and calls and cumulative time per prelude and model function.
+
+VALUATION_PROFILE=1 records in every process, with VALUATION_PROFILE_DIR=dir each process also
+writes its numbers to dir/profile-<pid>.json when it exits. Merge them with
+
+    python profiling.py dir -o profile.json --prometheus profile.prom
+
+Models are told apart by the key of their translated source, the one in '<valuation ...>'.
+"""
+
+import argparse
+import ast
+import atexit
+import contextlib
+import json
+import multiprocessing.util
+import os
+import re
+import sys
+import threading
+import time
+
+# name of the hook called by code instrumented for profiling, set in the globals of the run
+PROFILE_HOOK = '_js_profile'
+
+_FUNCTION_NAME = re.compile(r'^PyJs(?:Hoisted_(.+)_|_(.+)_\d+_)$')
+
+
+class _Call:
+    __slots__ = ('profiler', 'name', 'started')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        active = self.profiler._local.__dict__.setdefault('active', {})
+        depth = active.get(self.name, 0)
+        active[self.name] = depth + 1
+        # recursive calls are counted, their time is already in the outermost call
+        self.started = time.perf_counter() if depth == 0 else None
+
+    def __exit__(self, *exc_info):
+        elapsed = 0.0 if self.started is None else time.perf_counter() - self.started
+        self.profiler._local.active[self.name] -= 1
+        self.profiler._add(self.profiler.functions, self.name, (1, elapsed))
+
+
+class _Stage:
+    __slots__ = ('profiler', 'key', 'wall', 'cpu')
+
+    def __init__(self, profiler, key):
+        self.profiler = profiler
+        self.key = key
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+
+    def __exit__(self, *exc_info):
+        # the CPU time is of the thread, concurrent coroutines of a fetch share it
+        self.profiler._add(self.profiler.stages, self.key,
+                           (1, time.perf_counter() - self.wall, time.thread_time() - self.cpu))
+
+
+class Profiler:
+    """
+    Counters of one process. stages maps (stage, model) to [count, wall, cpu] seconds and
+    functions maps a JS function name to [calls, seconds]. Disabled, stage() and call() cost a
+    function call and record nothing.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {}
+        self.functions = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def stage(self, name, model=''):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return _Stage(self, (name, model))
+
+    def call(self, name):
+        return _Call(self, name)
+
+    def _add(self, table, key, values):
+        with self._lock:
+            totals = table.get(key)
+            if totals is None:
+                table[key] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    totals[i] += value
+
+    def install(self, namespace):
+        """Set the hook of instrumented code in the globals of a run."""
+        namespace[PROFILE_HOOK] = self.call
+        return namespace
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.functions.clear()
+
+    def report(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'stages': [{'stage': stage, 'model': model, 'count': count, 'wall': wall, 'cpu': cpu}
+                           for (stage, model), (count, wall, cpu) in sorted(self.stages.items())],
+                'functions': [{'function': name, 'calls': calls, 'seconds': seconds}
+                              for name, (calls, seconds) in sorted(self.functions.items())],
+            }
+
+    def dump(self, directory):
+        report = self.report()
+        if report['stages'] or report['functions']:
+            with open(os.path.join(directory, f"profile-{os.getpid()}.json"), 'w') as f:
+                json.dump(report, f)
+
+
+def function_name(python_name):
+    """JS name of a js2py translated function: PyJsHoisted_addKey_ -> addKey, PyJs_anonymous_3_ -> anonymous."""
+    match = _FUNCTION_NAME.match(python_name)
+    if match is None:
+        return python_name
+    return match.group(1) or match.group(2)
+
+
+class _Instrument(ast.NodeTransformer):
+
+    def visit_FunctionDef(self, node):
+        self.generic_visit(node)
+        if node.name.startswith('PyJs'):
+            call = ast.Call(ast.Name(PROFILE_HOOK, ast.Load()), [ast.Constant(function_name(node.name))], [])
+            node.body = [ast.copy_location(ast.With([ast.withitem(call)], node.body), node.body[0])]
+        return node
+
+
+def instrument_calls(python_source):
+    """Time every function of js2py output (source or AST) through PROFILE_HOOK."""
+    tree = python_source if isinstance(python_source, ast.AST) else ast.parse(python_source)
+    return ast.fix_missing_locations(_Instrument().visit(tree))
+
+
+def timed_helper(name, function):
+    """
+    Wrap a native helper so its calls are profiled as name. The wrapper has the same parameters
+    (..., this, arguments, var) because js2py reads them from the code object.
+    """
+    code = function.__code__
+    parameters = code.co_varnames[:code.co_argcount]
+    namespace = {'_function': function, '_call': profiler.call, '_name': name}
+    exec(f"def {function.__name__}({', '.join(parameters[:-1])}, {parameters[-1]}=None):\n"
+         f"    with _call(_name):\n"
+         f"        return _function({', '.join(parameters)})\n", namespace)
+    return namespace[function.__name__]
+
+
+def merge(reports):
+    stages = {}
+    functions = {}
+    for report in reports:
+        for row in report['stages']:
+            totals = stages.setdefault((row['stage'], row['model']), [0, 0.0, 0.0])
+            totals[0] += row['count']
+            totals[1] += row['wall']
+            totals[2] += row['cpu']
+        for row in report['functions']:
+            totals = functions.setdefault(row['function'], [0, 0.0])
+            totals[0] += row['calls']
+            totals[1] += row['seconds']
+    merged = Profiler()
+    merged.stages = stages
+    merged.functions = functions
+    return merged
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus(profiler):
+    """Prometheus text exposition of the counters."""
+    lines = []
+    stage_metrics = [
+        ('valuation_stage_total', 'Completed valuation stages.', 0),
+        ('valuation_stage_seconds_total', 'Wall time spent in valuation stages.', 1),
+        ('valuation_stage_cpu_seconds_total', 'CPU time spent in valuation stages.', 2),
+    ]
+    for metric, description, index in stage_metrics:
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+        for (stage, model), totals in sorted(profiler.stages.items()):
+            lines.append(f'{metric}{{stage="{_label(stage)}",model="{_label(model)}"}} {totals[index]}')
+    function_metrics = [
+        ('valuation_function_calls_total', 'Calls of prelude and model functions.', 0),
+        ('valuation_function_seconds_total', 'Cumulative time of prelude and model functions.', 1),
+    ]
+    for metric, description, index in function_metrics:
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+        for name, totals in sorted(profiler.functions.items()):
+            lines.append(f'{metric}{{function="{_label(name)}"}} {totals[index]}')
+    return '\n'.join(lines) + '\n'
+
+
+# shared per-process profiler, VALUATION_PROFILE=1 turns it on
+profiler = Profiler(os.environ.get('VALUATION_PROFILE', '0') != '0')
+PROFILE_DIR = os.environ.get('VALUATION_PROFILE_DIR')
+
+
+def _dump_at_exit():
+    if profiler.enabled and PROFILE_DIR:
+        profiler.dump(PROFILE_DIR)
+
+
+def _after_fork(profiler):
+    # a forked worker starts from zero and, not running atexit handlers, dumps from the
+    # multiprocessing exit hooks instead
+    profiler.reset()
+    multiprocessing.util.Finalize(profiler, _dump_at_exit, exitpriority=10)
+
+
+if PROFILE_DIR:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    atexit.register(_dump_at_exit)
+    multiprocessing.util.register_after_fork(profiler, _after_fork)
+    if multiprocessing.parent_process() is not None:
+        multiprocessing.util.Finalize(profiler, _dump_at_exit, exitpriority=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the profiles written by valuation processes.")
+    parser.add_argument('directory', help="VALUATION_PROFILE_DIR of the runs")
+    parser.add_argument('-o', '--output', default='-', help="merged JSON report, '-' for stdout")
+    parser.add_argument('--prometheus', help="also write the Prometheus text format to this file")
+    args = parser.parse_args()
+
+    reports = []
+    for name in sorted(os.listdir(args.directory)):
+        if name.startswith('profile-') and name.endswith('.json'):
+            with open(os.path.join(args.directory, name), 'r') as f:
+                reports.append(json.load(f))
+    merged = merge(reports)
+    report = merged.report()
+    del report['pid']
+    report['processes'] = len(reports)
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    with output if output is not sys.stdout else contextlib.nullcontext():
+        json.dump(report, output, indent=2)
+        output.write('\n')
+    if args.prometheus:
+        with open(args.prometheus, 'w') as f:
+            f.write(prometheus(merged))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import os
+from collections.abc import Mapping
+
+from js2py.base import ArrayPrototype, Js, ObjectPrototype, PyJsArray, PyJsObject
+
+from statements import Statement
+
+# COW_REPORTS=0 converts the fetched reports into new JS objects for every run instead
+COW_REPORTS = os.environ.get('COW_REPORTS', '1') != '0'
+
+
+class _CowProperties(dict):
+    """
+    Property table of a JS object backed by a Python list or dict that is never written.
+
+    js2py keeps the properties of an object in its `own` dict of descriptors. This one starts
+    empty and creates the descriptor of a property the first time it is looked up, values of the
+    shared data are wrapped on the way. Writes and deletes only change this table.
+    """
+
+    def __init__(self, base, initial=None):
+        super().__init__(initial or {})
+        self._base = base
+        self._is_list = not isinstance(base, Mapping)
+        self._deleted = set()
+        # key -> value as loaded from base, tells untouched properties from written ones
+        self._loaded = {}
+
+    def _base_key(self, key):
+        if key in self._deleted:
+            return False
+        if self._is_list:
+            return key.isdigit() and str(int(key)) == key and int(key) < len(self._base)
+        return key in self._base
+
+    def _load(self, key):
+        value = self._base[int(key)] if self._is_list else self._base[key]
+        descriptor = {'value': shared_value(value), 'writable': True, 'enumerable': True, 'configurable': True}
+        self._loaded[key] = descriptor['value']
+        dict.__setitem__(self, key, descriptor)
+        return descriptor
+
+    def __missing__(self, key):
+        # loaded descriptors are found by dict itself, only the first lookup gets here.
+        # Like get(), a missing property is None instead of a KeyError
+        if isinstance(key, str) and self._base_key(key):
+            return self._load(key)
+        return None
+
+    def get(self, key, default=None):
+        descriptor = self[key]
+        return default if descriptor is None else descriptor
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (isinstance(key, str) and self._base_key(key))
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._deleted.add(key)
+        if dict.__contains__(self, key):
+            dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        if key in self:
+            descriptor = self[key]
+            del self[key]
+            return descriptor
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def keys(self):
+        if self._is_list:
+            names = [str(i) for i in range(len(self._base))]
+        else:
+            names = list(self._base)
+        names = [name for name in names if name not in self._deleted and not dict.__contains__(self, name)]
+        return list(dict.keys(self)) + names
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+
+class _CowObject(PyJsObject):
+    def get_own_property(self, prop):
+        # own[prop] stays on the C fast path of dict once the property is loaded
+        return self.own[prop]
+
+
+class _CowArray(PyJsArray):
+    def get_own_property(self, prop):
+        return self.own[prop]
+
+
+def shared_value(value):
+    """
+    JS view of a value of a fetched response.
+
+    Lists and dicts become copy-on-write objects over the Python data: nothing is converted up
+    front, a row is only turned into JS properties as the model reads it and whatever the model
+    writes stays in the view of this run. Responses can therefore be shared by the response
+    cache, coalesced requests and parallel runs without a deep copy per run.
+    """
+    if isinstance(value, Mapping):
+        view = _CowObject({}, ObjectPrototype)
+        view.own = _CowProperties(value)
+        return view
+    if isinstance(value, (list, Statement)):
+        view = _CowArray([], ArrayPrototype)
+        view.own = _CowProperties(value, {'length': view.own['length']})
+        view.own['length']['value'] = Js(len(value))
+        return view
+    return Js(value)
+
+
+def _untouched(own, key):
+    if key in own._deleted:
+        return False
+    descriptor = dict.get(own, key)
+    return descriptor is None or descriptor['value'] is own._loaded.get(key)
+
+
+def statement_column(view, field):
+    """
+    The array('d') column of field when view is the view of a Statement whose rows and field the
+    model has not changed, so the column holds exactly what the model would read. None otherwise.
+    """
+    own = getattr(view, 'own', None)
+    if not isinstance(own, _CowProperties) or not isinstance(own._base, Statement):
+        return None
+    column = own._base.column(field)
+    if column is None or own._deleted or own['length']['value'].value != len(column):
+        return None
+    for key in own._loaded:
+        row = dict.get(own, key)
+        if row is None or row['value'] is not own._loaded[key] or not _untouched(row['value'].own, field):
+            return None
+    return column
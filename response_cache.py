@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from atomic_write import write_atomic
+
+# seconds a response stays fresh, by endpoint or (endpoint, period)
+DEFAULT_TTLS = {
+    'quote': 60,
+    'profile': 24 * 3600,
+    'treasury': 6 * 3600,
+    'income-statement/ltm': 24 * 3600,
+    'cash-flow-statement/ltm': 24 * 3600,
+    ('income-statement', 'annual'): 7 * 24 * 3600,
+    ('balance-sheet-statement', 'annual'): 7 * 24 * 3600,
+    ('cash-flow-statement', 'annual'): 7 * 24 * 3600,
+    ('income-statement', 'quarter'): 24 * 3600,
+    ('balance-sheet-statement', 'quarter'): 24 * 3600,
+    ('cash-flow-statement', 'quarter'): 24 * 3600,
+}
+DEFAULT_TTL = 3600
+
+# batched requests name several tickers, /v3/quote/AAPL,MSFT
+_TICKER_REGEX = re.compile(r'^[A-Z0-9.\-^,]+$')
+_VERSION_REGEX = re.compile(r'^v\d+$')
+
+
+def describe_url(url):
+    """
+    Split an API url into (endpoint, ticker, period, extra query), leaving out the api key.
+    https://financialmodelingprep.com/api/v3/income-statement/AAPL?period=quarter&apikey=...
+    -> ('income-statement', 'AAPL', 'quarter', '')
+    """
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != 'apikey']
+    period = 'annual'
+    extra = []
+    for k, v in query:
+        if k == 'period':
+            period = v
+        else:
+            extra.append((k, v))
+
+    segments = [segment for segment in parts.path.split('/') if segment]
+    if 'api' in segments:
+        segments = segments[segments.index('api') + 1:]
+    segments = [segment for segment in segments if not _VERSION_REGEX.match(segment)]
+    ticker = ''
+    if segments and _TICKER_REGEX.match(segments[-1]):
+        ticker = segments.pop()
+    return '/'.join(segments), ticker, period, urlencode(sorted(extra))
+
+
+class ResponseCache:
+    """
+    Persistent cache of API responses, one JSON file per (endpoint, ticker, period).
+
+    Entries are fresh for the endpoint TTL, then served stale for another ttl * stale_ratio
+    seconds while a background request refreshes them. The directory is kept under max_bytes
+    by removing the least recently used entries.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 2 ** 20, ttls=None, stale_ratio=1.0, clock=time.time):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.stale_ratio = stale_ratio
+        self.clock = clock
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._size = None
+        self._refreshing = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def ttl(self, url):
+        endpoint, _, period, _ = describe_url(url)
+        return self.ttls.get((endpoint, period), self.ttls.get(endpoint, DEFAULT_TTL))
+
+    def path(self, url):
+        key = '|'.join(describe_url(url))
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url):
+        """Return (body, fresh) or None when the url is not cached or too old to serve."""
+        path = self.path(url)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        age = self.clock() - entry['stored']
+        ttl = self.ttl(url)
+        if age > ttl * (1 + self.stale_ratio):
+            self.misses += 1
+            return None
+        # the file mtime is the last use, eviction removes the oldest ones first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        fresh = age <= ttl
+        if fresh:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+        return entry['body'], fresh
+
+    def set(self, url, body):
+        path = self.path(url)
+        data = json.dumps({'url': url, 'stored': self.clock(), 'body': body})
+        write_atomic(path, data)
+        if self._size is not None:
+            # overwrites are counted twice, evict() recounts from the directory
+            self._size += len(data)
+        if self.size() > self.max_bytes:
+            self.evict()
+
+    def size(self):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self, target_ratio=0.9):
+        """Remove least recently used entries until the cache is below target_ratio * max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(size for _, size, _ in entries)
+        for path, entry_size, _ in entries:
+            if size <= self.max_bytes * target_ratio:
+                break
+            try:
+                os.remove(path)
+                size -= entry_size
+            except OSError:
+                pass
+        self._size = size
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            os.remove(path)
+        self._size = 0
+
+    def revalidate(self, url, fetch=None):
+        """Refresh a stale url in the background, at most one refresh per url at a time."""
+        if url in self._refreshing:
+            return self._refreshing[url]
+        fetch = fetch or _fetch
+        import aiohttp
+
+        async def refresh():
+            try:
+                body = await fetch(url)
+                self.set(url, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                # keep serving the stale entry, the next request will try again
+                pass
+            finally:
+                del self._refreshing[url]
+
+        task = self._refreshing[url] = asyncio.ensure_future(refresh())
+        return task
+
+    async def drain(self):
+        """Wait for the background refreshes, short lived event loops should call it before exiting."""
+        while self._refreshing:
+            await asyncio.gather(*self._refreshing.values(), return_exceptions=True)
+
+
+async def _fetch(url):
+    # refreshes outlive the session of the request that found the stale entry
+    import aiohttp
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            return json.loads(await response.text())
+
+
+# enabled by pointing RESPONSE_CACHE_DIR to a directory
+response_cache = ResponseCache(os.environ['RESPONSE_CACHE_DIR']) if os.environ.get('RESPONSE_CACHE_DIR') else None
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from atomic_write import write_atomic
+from model_cache import ModelCache
+from statements import Statement
+
+
+def fingerprint(responses):
+    """Hash of the fetched data of a valuation, changes whenever a response body does."""
+    digest = hashlib.sha256()
+    for response in responses:
+        if isinstance(response, Statement):
+            digest.update(b'S')
+            response.fingerprint(digest)
+        else:
+            digest.update(b'J' + json.dumps(response, sort_keys=True, default=repr).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def normalize_input_params(input_params):
+    # {'MAX': 52, 'MIN': '51'} and {'MIN': 51.0, 'MAX': 52.0} are the same run
+    normalized = []
+    for name, value in sorted((input_params or {}).items()):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            pass
+        normalized.append((name, value))
+    return json.dumps(normalized)
+
+
+class ResultCache:
+    """
+    Results of valuation runs, keyed by (model, data fingerprint, inputs).
+
+    A run is repeated only when one of the three changed: new data gives a new fingerprint and
+    so a new key, the results of the old data are never served and age out. Entries live in an
+    in-memory LRU for ttl seconds, with a directory they are also written to one JSON file each
+    so other processes and later runs can reuse them.
+    """
+
+    def __init__(self, maxsize=4096, ttl=3600, directory=None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = directory
+        self.clock = clock
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(source, responses, input_params):
+        parts = (ModelCache.key(source), fingerprint(responses), normalize_input_params(input_params))
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """Return the stored {'value', 'ccy', 'logs'} or None."""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry['stored'] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry['result']
+                del self._entries[key]
+
+        if self.directory:
+            entry = self._read(key)
+            if entry is not None and now - entry['stored'] <= self.ttl:
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry['result']
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ccy, logs=''):
+        entry = {'stored': self.clock(), 'result': {'value': value, 'ccy': ccy, 'logs': logs}}
+        self._remember(key, entry)
+        if self.directory:
+            write_atomic(self.path(key), json.dumps(entry))
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _read(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.clock() - entry['stored'] > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def evict(self):
+        """Drop the expired entries from memory and from the directory."""
+        now = self.clock()
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if now - entry['stored'] > self.ttl]:
+                del self._entries[key]
+        if self.directory:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.json'):
+                    self._read(entry.name[:-len('.json')])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.directory:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.json'):
+                    os.remove(entry.path)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# RESULT_CACHE=0 always runs the model, RESULT_CACHE_DIR adds the on-disk tier
+result_cache = ResultCache(int(os.environ.get('RESULT_CACHE_SIZE', 4096)),
+                           float(os.environ.get('RESULT_CACHE_TTL', 3600)),
+                           os.environ.get('RESULT_CACHE_DIR')) if os.environ.get('RESULT_CACHE', '1') != '0' else None
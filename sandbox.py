@@ -0,0 +1,248 @@
+import io
+import math
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import threading
+from contextlib import redirect_stdout
+
+from preprocessor import parse_model
+from step_budget import StepBudget, StepBudgetExceeded
+
+# defaults, every SandboxPool argument can override them
+SANDBOX_WORKERS = int(os.environ.get('SANDBOX_WORKERS', os.cpu_count() or 1))
+SANDBOX_TIMEOUT = float(os.environ.get('SANDBOX_TIMEOUT', 5))
+SANDBOX_MEMORY_MB = int(os.environ.get('SANDBOX_MEMORY_MB', 1024))
+SANDBOX_MAX_EXECUTIONS = int(os.environ.get('SANDBOX_MAX_EXECUTIONS', 200))
+# loop iterations and function calls per run, code.txt takes a few hundred. 0 disables the count
+SANDBOX_STEPS = int(os.environ.get('SANDBOX_STEPS', 100000))
+# console output kept per run, a logging loop would otherwise fill the memory
+SANDBOX_LOG_LIMIT = 64 * 1024
+
+
+class SandboxError(Exception):
+    pass
+
+
+class SandboxTimeout(SandboxError):
+    pass
+
+
+class SandboxMemoryError(SandboxError):
+    pass
+
+
+class SandboxCrash(SandboxError):
+    pass
+
+
+class SandboxStepLimit(SandboxError):
+    pass
+
+
+class ModelError(SandboxError):
+    """The model itself failed (syntax error, JS exception, ...)."""
+
+    def __init__(self, message, logs=''):
+        super().__init__(message)
+        self.logs = logs
+
+
+class _CpuLimit(BaseException):
+    # BaseException so `except Exception` in helpers does not swallow it
+    pass
+
+
+class _LimitedLog(io.StringIO):
+    def write(self, text):
+        room = SANDBOX_LOG_LIMIT - self.tell()
+        if room > 0:
+            super().write(text[:room])
+        return len(text)
+
+
+def _raise_cpu_limit(signum, frame):
+    raise _CpuLimit()
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _worker_main(connection, memory_bytes, max_executions):
+    # imported here so that a parent that never starts a pool does not load js2py for nothing
+    from final import build_context, execute_valuation
+    from model_cache import model_cache
+    from prelude import get_prelude
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGXCPU, _raise_cpu_limit)
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    # let js2py load its builtins before the first job
+    model_cache.execute(get_prelude(), {})
+
+    for executions in range(1, max_executions + 1):
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        spec, responses, input_params, cpu_seconds, steps = job
+        logs = _LimitedLog()
+        retire = executions == max_executions
+        # RLIMIT_CPU counts the whole life of the process, move the soft limit for every job
+        hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        resource.setrlimit(resource.RLIMIT_CPU, (math.ceil(_cpu_time() + cpu_seconds), hard))
+        try:
+            with redirect_stdout(logs):
+                context = build_context(spec.done_parameters, responses, input_params)
+                scope = execute_valuation(spec.source, context, budget=StepBudget(steps) if steps else None)
+            reply = ('ok', {'value': scope._return_value, 'ccy': scope._return_ccy, 'logs': logs.getvalue()})
+        except StepBudgetExceeded as e:
+            # stopped between two steps, the worker is fine
+            reply = ('steps', str(e), logs.getvalue())
+        except _CpuLimit:
+            reply, retire = ('timeout', logs.getvalue()), True
+        except MemoryError:
+            reply, retire = ('memory', logs.getvalue()), True
+        except Exception as e:
+            reply = ('error', f"{type(e).__name__}: {e}", logs.getvalue())
+        finally:
+            resource.setrlimit(resource.RLIMIT_CPU, (resource.RLIM_INFINITY, hard))
+        # a worker that hit a limit may be left in a bad state, it is replaced
+        connection.send(reply + (retire,))
+        if retire:
+            return
+
+
+class _Worker:
+    def __init__(self, context, limits):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child,) + limits, daemon=True)
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+    def close(self):
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        self.kill()
+
+
+class SandboxPool:
+    """
+    Pre-forked worker processes that run untrusted valuation models.
+
+    Every worker has an address space limit (memory_mb) and a CPU time budget per run
+    (timeout), a worker that goes past the wall clock timeout is killed. Runaway loops are
+    normally stopped much earlier by the step budget (steps), which also does not depend on
+    the load of the machine. Workers are replaced
+    after a limit was hit or after max_executions runs, the replacement is forked from the
+    parent with the translated prelude already loaded. evaluate() is thread safe and runs up
+    to `workers` models at the same time.
+    """
+
+    def __init__(self, workers=SANDBOX_WORKERS, timeout=SANDBOX_TIMEOUT, memory_mb=SANDBOX_MEMORY_MB,
+                 max_executions=SANDBOX_MAX_EXECUTIONS, steps=SANDBOX_STEPS, preload=True):
+        self.size = workers
+        self.timeout = timeout
+        self.steps = steps
+        self.limits = (memory_mb * 2 ** 20 if memory_mb else 0, max_executions)
+        self.executions = 0
+        self.respawns = 0
+        self._context = multiprocessing.get_context('fork')
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        if preload:
+            # forked workers inherit the loaded js2py builtins and translations of the parent
+            from model_cache import model_cache
+            from prelude import get_prelude
+            model_cache.execute(get_prelude(), {})
+        for _ in range(workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        worker = _Worker(self._context, self.limits)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _replace(self, worker):
+        worker.kill()
+        with self._lock:
+            self._workers.discard(worker)
+            self.respawns += 1
+        if not self._closed:
+            self._idle.put(self._spawn())
+
+    def evaluate(self, model, responses, input_params=None, timeout=None, steps=None):
+        """
+        Run a model (raw source or ModelSpec) on the fetched responses and return
+        {'value', 'ccy', 'logs'}. Raises ModelError, SandboxStepLimit, SandboxTimeout,
+        SandboxMemoryError or SandboxCrash.
+        """
+        if self._closed:
+            raise SandboxError("pool is closed")
+        spec = parse_model(model) if isinstance(model, str) else model
+        timeout = self.timeout if timeout is None else timeout
+        steps = self.steps if steps is None else steps
+        worker = self._idle.get()
+        with self._lock:
+            self.executions += 1
+        try:
+            worker.connection.send((spec, responses, input_params or {}, timeout, steps))
+            # the CPU limit (whole seconds) normally ends a runaway model first,
+            # this catches sleeping or stuck workers
+            if not worker.connection.poll(timeout + 2):
+                self._replace(worker)
+                raise SandboxTimeout(f"model did not finish within {timeout}s")
+            reply = worker.connection.recv()
+        except (EOFError, OSError):
+            # killed by the kernel (RLIMIT_AS during startup, OOM killer, signal, ...)
+            worker.process.join(1)
+            self._replace(worker)
+            raise SandboxCrash(f"worker died with exit code {worker.process.exitcode}")
+
+        status, retire = reply[0], reply[-1]
+        if retire:
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        if status == 'ok':
+            return reply[1]
+        if status == 'steps':
+            raise SandboxStepLimit(reply[1])
+        if status == 'timeout':
+            raise SandboxTimeout(f"model used more than {timeout}s of CPU time")
+        if status == 'memory':
+            raise SandboxMemoryError("model ran out of memory")
+        raise ModelError(reply[1], reply[2])
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,59 @@
+import threading
+
+from js2py.base import Js
+
+from final import build_context
+from model_cache import model_cache
+from prelude import NATIVE_HELPERS, base_globals, get_prelude, install_native_helpers
+from preprocessor import parse_model
+from profiling import profiler
+from step_budget import STEP_HOOK
+from sweep import fetch_responses
+
+
+class ValuationSession:
+    """
+    One model and one ticker kept ready for re-valuations with different inputs (sliders).
+
+    The data is fetched and the model translated once. The prelude runs once into a JS scope
+    whose globals are then snapshotted; evaluate() puts the globals back to that snapshot, adds
+    fresh copy-on-write views of the data and the new _input_params and runs only the model,
+    after the initialisers of the prelude globals so that objects like _input_global are new.
+    Runs of one session are serialized, use a session per thread for parallel runs.
+    """
+
+    def __init__(self, raw_model, ticker=None, responses=None, cache=model_cache, native_helpers=NATIVE_HELPERS):
+        self.raw_model = raw_model
+        self.model = parse_model(raw_model)
+        self.ticker = ticker
+        self.responses = fetch_responses(raw_model, ticker) if responses is None else responses
+        self.cache = cache
+        self.runs = 0
+        self._source = base_globals + '\n' + self.model.source + '\n_when_done();'
+        context = install_native_helpers({}) if native_helpers else {}
+        self._scope = cache.execute(get_prelude(native_helpers), context)
+        self._globals = self._scope.context['var']
+        # the descriptors are copied too, a run assigns to the value of the existing ones
+        self._snapshot = {name: dict(descriptor) for name, descriptor in self._globals.own.items()}
+        self._lock = threading.Lock()
+        cache.get(self._source)
+
+    def evaluate(self, input_params=None, budget=None):
+        """Run the model with new inputs and return {'value', 'ccy'}, console.log still goes to stdout."""
+        with self._lock:
+            # names the previous run created or changed are dropped with the rest of its state
+            self._globals.own.clear()
+            self._globals.own.update({name: dict(descriptor) for name, descriptor in self._snapshot.items()})
+            context = build_context(self.model.done_parameters, self.responses, dict(input_params or {}))
+            for name, value in context.items():
+                self._globals.put(name, Js(value))
+            self._scope.context[STEP_HOOK] = None if budget is None else budget.tick
+            compiled = self.cache.get(self._source, budgeted=budget is not None)
+            with profiler.stage('execute', self.cache.key(self._source)[:12] if profiler.enabled else ''):
+                exec(compiled, profiler.install(self._scope.context))
+            self.runs += 1
+            return {'value': self._scope._return_value, 'ccy': self._scope._return_ccy}
+
+    def refresh(self):
+        """Fetch the data of the ticker again, the translated model and the snapshot are kept."""
+        self.responses = fetch_responses(self.raw_model, self.ticker)
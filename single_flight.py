@@ -0,0 +1,40 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces identical requests that are in flight at the same time.
+
+    The first caller of a key starts the request, every caller arriving before it completes
+    awaits the same future and gets the same parsed result (or exception). The result object
+    is shared, callers must not modify it.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.saved = 0
+        self._in_flight = {}
+
+    async def run(self, key, factory):
+        """Await factory() once for all concurrent callers of key."""
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        task = self._in_flight.get(key)
+        if task is not None and task.get_loop() is loop:
+            self.saved += 1
+        else:
+            task = self._in_flight[key] = loop.create_task(factory())
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # a cancelled caller must not cancel the request the others are waiting for
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def stats(self):
+        return {'calls': self.calls, 'saved': self.saved, 'in_flight': len(self._in_flight)}
+
+
+# shared by every fetch of the process, keyed by url
+single_flight = SingleFlight()
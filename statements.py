@@ -0,0 +1,149 @@
+import os
+from array import array
+from collections.abc import Mapping, Sequence
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# COLUMNAR_STATEMENTS=0 keeps the statements as the list of dicts the API returned
+COLUMNAR_STATEMENTS = os.environ.get('COLUMNAR_STATEMENTS', '1') != '0'
+
+# a field missing in some rows of a text column
+_MISSING = object()
+# larger integers do not survive a double
+_MAX_EXACT_INT = 2 ** 53
+
+
+class Statement(Sequence):
+    """
+    Financial statement held by column instead of as a list of per year dicts.
+
+    Fields that are a number in every row are kept in one array('d') each, the others (date,
+    symbol, links, nulls) in plain lists. Indexing returns StatementRow mappings, so code written
+    for the list of dicts keeps working. The data is never modified after it is built.
+    """
+
+    __slots__ = ('fields', 'columns', 'integral', 'length', '_dates')
+
+    def __init__(self, fields, columns, integral, length):
+        self.fields = fields
+        self.columns = columns
+        # numeric fields whose values were all ints
+        self.integral = integral
+        self.length = length
+        self._dates = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        fields = list(dict.fromkeys(key for row in rows for key in row))
+        columns = {}
+        integral = set()
+        for field in fields:
+            values = [row.get(field, _MISSING) for row in rows]
+            numeric = all(type(value) in (int, float) for value in values)
+            if numeric and all(type(value) is float or -_MAX_EXACT_INT <= value <= _MAX_EXACT_INT for value in values):
+                columns[field] = array('d', values)
+                if all(type(value) is int for value in values):
+                    integral.add(field)
+            else:
+                columns[field] = values
+        return cls(fields, columns, frozenset(integral), len(rows))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [StatementRow(self, i) for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('statement row out of range')
+        return StatementRow(self, index)
+
+    def __eq__(self, other):
+        if isinstance(other, (Statement, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __reduce__(self):
+        return Statement, (self.fields, self.columns, self.integral, self.length)
+
+    def value(self, index, field):
+        value = self.columns[field][index]
+        if value is _MISSING:
+            raise KeyError(field)
+        if field in self.integral:
+            return int(value)
+        return value
+
+    def column(self, field):
+        """The array('d') of a numeric field, None for text fields."""
+        column = self.columns.get(field)
+        return column if isinstance(column, array) else None
+
+    def index(self, date):
+        """Row index of a date, None when the statement has no such row."""
+        if self._dates is None:
+            dates = self.columns.get('date', [])
+            self._dates = {date: i for i, date in reversed(list(enumerate(dates)))}
+        return self._dates.get(date)
+
+    def to_rows(self):
+        return [dict(row) for row in self]
+
+    def fingerprint(self, digest):
+        """Feed the data to a hashlib digest, equal statements give equal digests in every process."""
+        for field in self.fields:
+            column = self.columns[field]
+            digest.update(field.encode('utf-8') + (b'i' if field in self.integral else b'\0'))
+            if isinstance(column, array):
+                digest.update(column.tobytes())
+            else:
+                digest.update(repr([None if value is _MISSING else (type(value).__name__, value)
+                                    for value in column]).encode('utf-8'))
+
+
+class StatementRow(Mapping):
+    """One row of a Statement, read only."""
+
+    __slots__ = ('statement', 'row')
+
+    def __init__(self, statement, row):
+        self.statement = statement
+        self.row = row
+
+    def __getitem__(self, field):
+        if field not in self.statement.columns:
+            raise KeyError(field)
+        return self.statement.value(self.row, field)
+
+    def __contains__(self, field):
+        column = self.statement.columns.get(field)
+        return column is not None and column[self.row] is not _MISSING
+
+    def __iter__(self):
+        return (field for field in self.statement.fields if field in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def decode_statement(body):
+    """Turn a statement response (a list of dicts with a date) into a Statement, anything else is returned as is."""
+    if (COLUMNAR_STATEMENTS and isinstance(body, list) and body
+            and all(type(row) is dict and 'date' in row for row in body)):
+        return Statement.from_rows(body)
+    return body
+
+
+def as_array(column):
+    """NumPy view of an array('d') column without copying, None without NumPy."""
+    if numpy is None:
+        return None
+    return numpy.frombuffer(column, dtype=numpy.float64)
@@ -0,0 +1,69 @@
+import ast
+import os
+
+# name of the hook called by instrumented code, set in the globals of every budgeted run
+STEP_HOOK = '_js_step'
+
+# MODEL_STEP_BUDGET=0 runs models without counting
+MODEL_STEP_BUDGET = int(os.environ.get('MODEL_STEP_BUDGET', 0))
+
+
+class StepBudgetExceeded(Exception):
+    """Raised inside a run when it used up its steps. Not a PyJsException, JS catch blocks do not see it."""
+
+    def __init__(self, steps):
+        super().__init__(f"model used more than {steps} steps")
+        self.steps = steps
+
+
+class StepCancelled(StepBudgetExceeded):
+    def __init__(self, steps):
+        Exception.__init__(self, f"model cancelled after {steps} steps")
+        self.steps = steps
+
+
+class StepBudget:
+    """
+    Steps a single run may take, a step is one loop iteration or function call of the model.
+
+    Every run gets its own budget in the globals of its scope, so runs in different threads do
+    not share counters. cancel() may be called from any thread, the run stops at its next step.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.remaining = steps
+        self.cancelled = False
+
+    @property
+    def used(self):
+        return self.steps - self.remaining
+
+    def tick(self):
+        self.remaining -= 1
+        if self.remaining < 0 or self.cancelled:
+            if self.cancelled:
+                raise StepCancelled(self.used)
+            raise StepBudgetExceeded(self.steps)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Instrument(ast.NodeTransformer):
+    # js2py turns every JS loop into a Python while/for and every JS function into a def
+
+    def _count(self, node):
+        self.generic_visit(node)
+        step = ast.Expr(ast.Call(ast.Name(STEP_HOOK, ast.Load()), [], []))
+        node.body.insert(0, ast.copy_location(step, node.body[0] if node.body else node))
+        return node
+
+    visit_While = visit_For = visit_FunctionDef = _count
+
+
+def instrument(python_source):
+    """Add a STEP_HOOK() call at the start of every loop body and function of js2py output (source or AST)."""
+    tree = python_source if isinstance(python_source, ast.AST) else ast.parse(python_source)
+    tree = _Instrument().visit(tree)
+    return ast.fix_missing_locations(tree)
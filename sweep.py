@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Sensitivity tables: one model, one ticker, many _input_params combinations.
+
+    python sweep.py code.txt AAPL --grid _DISCOUNT_RATE=7,8,9 --grid _GROWTH=1,2,3 -j 4
+
+The ticker data is fetched once and every worker translates the model once, each combination
+only re-runs it with different inputs. With two swept parameters the values are printed as a
+table (first parameter down, second across), otherwise as one row per combination.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from final import async_api_get, build_context, execute_valuation, get_urls, parse_input_params
+from model_cache import model_cache
+from prelude import NATIVE_HELPERS, get_prelude
+from preprocessor import parse_model
+
+# per worker process state, set by _init_worker
+_model = None
+_responses = None
+
+
+def expand_grid(grid):
+    """{'A': [1, 2], 'B': [3]} -> [{'A': 1, 'B': 3}, {'A': 2, 'B': 3}]"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def _init_worker(raw_model, responses):
+    global _model, _responses
+    _model = parse_model(raw_model)
+    _responses = responses
+    model_cache.get(get_prelude(NATIVE_HELPERS) + _model.source + '\n_when_done();')
+
+
+def _evaluate(input_params):
+    result = {'value': None, 'ccy': None, 'error': None}
+    try:
+        context = build_context(_model.done_parameters, _responses, dict(input_params))
+        with contextlib.redirect_stdout(io.StringIO()):
+            scope = execute_valuation(_model.source, context)
+        result['value'] = scope._return_value
+        result['ccy'] = scope._return_ccy
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def fetch_responses(raw_model, ticker):
+    from http_client import api_client
+    functions = [name + ''.join(arguments) for name, arguments in parse_model(raw_model).when_calls]
+
+    async def fetch():
+        try:
+            return await async_api_get(get_urls(functions, ticker))
+        finally:
+            await api_client.close()
+
+    return asyncio.run(fetch())
+
+
+def sweep(raw_model, ticker, combinations, workers=None, base_params=None, responses=None):
+    """
+    Value ticker once per combination of input overrides (a list of dicts or a grid dict of
+    name -> values) and return a row per combination: the overrides plus value, ccy and error.
+    """
+    if isinstance(combinations, dict):
+        combinations = expand_grid(combinations)
+    if responses is None:
+        responses = fetch_responses(raw_model, ticker)
+    inputs = [dict(base_params or {}, **combination) for combination in combinations]
+
+    if workers == 1 or len(inputs) == 1:
+        _init_worker(raw_model, responses)
+        results = [_evaluate(params) for params in inputs]
+    else:
+        # the responses go to every worker once, a task only carries its inputs
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(raw_model, responses)) as executor:
+            chunksize = max(1, len(inputs) // (4 * (workers or os.cpu_count() or 1)))
+            results = list(executor.map(_evaluate, inputs, chunksize=chunksize))
+    return [dict(combination, **result) for combination, result in zip(combinations, results)]
+
+
+def pivot(rows, row_name, column_name):
+    """Two parameter sweep as a table: [[row_name \\ column_name, c1, c2, ...], [r1, v11, v12, ...], ...]"""
+    columns = list(dict.fromkeys(row[column_name] for row in rows))
+    values = {(row[row_name], row[column_name]): row['value'] for row in rows}
+    table = [[f"{row_name} \\ {column_name}"] + columns]
+    for row_value in dict.fromkeys(row[row_name] for row in rows):
+        table.append([row_value] + [values.get((row_value, column)) for column in columns])
+    return table
+
+
+def parse_grid(items):
+    # ['_DISCOUNT_RATE=7,8,9', 'YEARS=5'] -> {'_DISCOUNT_RATE': [7.0, 8.0, 9.0], 'YEARS': [5.0]}
+    grid = {}
+    for item in items:
+        name, values = item.split('=', 1)
+        grid[name.strip()] = [float(value) for value in values.split(',') if value.strip()]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Value a ticker over a grid of input parameters.")
+    parser.add_argument('model', help="valuation model file, e.g. code.txt")
+    parser.add_argument('ticker')
+    parser.add_argument('--grid', action='append', default=[], required=True,
+                        help="NAME=v1,v2,... swept parameter, repeat for more dimensions")
+    parser.add_argument('--input', default='', help="fixed input parameters, e.g. '#MIN=51&MAX=52'")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('-o', '--output', default='-', help="CSV output, '-' for stdout")
+    args = parser.parse_args()
+
+    with open(args.model, 'r') as f:
+        raw_model = f.read()
+    grid = parse_grid(args.grid)
+    rows = sweep(raw_model, args.ticker.upper(), grid, args.workers, parse_input_params(args.input))
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    with output if output is not sys.stdout else contextlib.nullcontext():
+        writer = csv.writer(output)
+        if len(grid) == 2:
+            writer.writerows(pivot(rows, *grid))
+        else:
+            writer.writerow(list(grid) + ['value', 'ccy', 'error'])
+            writer.writerows([row[name] for name in grid] + [row['value'], row['ccy'], row['error']] for row in rows)
+
+
+if __name__ == "__main__":
+    main()
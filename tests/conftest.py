@@ -0,0 +1,6 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules are top level scripts, the synthetic data is in benchmarks/fixtures.py
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks'), os.path.join(ROOT, 'explore-logs')]
@@ -0,0 +1,22 @@
+import batch
+
+MODEL = """
+$.when(get_income_statement()).done(function(income){
+    _StopIfWatch(1, 'USD');
+});
+"""
+
+
+def test_fetch_errors_report_the_fetch_time(monkeypatch):
+    async def fetch(urls):
+        raise ConnectionError("stub is down")
+
+    monkeypatch.setattr(batch, 'fetch', fetch)
+    batch.init_worker(MODEL, {})
+    try:
+        result = batch.value_ticker('AAPL')
+    finally:
+        batch._loop.close()
+    assert result['error'] == "ConnectionError: stub is down"
+    assert result['fetch_ms'] is not None
+    assert result['run_ms'] is None
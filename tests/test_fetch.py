@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from final import async_api_get
+from http_client import ApiClient, ApiError
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+from stub_server import StubServer
+
+PATHS = ['/api/v3/quote/AAPL', '/api/v3/profile/AAPL', '/api/v3/income-statement/AAPL']
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def server():
+    with StubServer() as server:
+        yield server
+
+
+def fetch(urls, cache=None, coalescer=None, copies=1, client=None):
+    async def run():
+        own = client or ApiClient(backoff=0.001)
+        try:
+            results = await asyncio.gather(*[async_api_get(urls, cache, own, coalescer or SingleFlight())
+                                             for _ in range(copies)])
+            if cache is not None:
+                await cache.drain()
+            return results
+        finally:
+            await own.close()
+
+    return asyncio.run(run())
+
+
+def test_entries_go_stale_then_expire(tmp_path):
+    clock = Clock()
+    cache = ResponseCache(str(tmp_path), clock=clock)
+    url = 'http://127.0.0.1/api/v3/quote/AAPL'
+    cache.set(url, [{'price': 1}])
+    assert cache.get(url) == ([{'price': 1}], True)
+    clock.now += cache.ttl(url) + 1
+    assert cache.get(url) == ([{'price': 1}], False)
+    clock.now += cache.ttl(url)
+    assert cache.get(url) is None
+    assert (cache.hits, cache.stale_hits, cache.misses) == (1, 1, 1)
+
+
+def test_stale_responses_are_served_and_refreshed_once(server, tmp_path):
+    clock = Clock()
+    cache = ResponseCache(str(tmp_path), clock=clock)
+    url = server.url + PATHS[0]
+    fetch([url], cache)
+    assert server.requests == 1
+    clock.now += cache.ttl(url) + 1
+    # five valuations find the stale quote, one background request refreshes it
+    fetch([url], cache, copies=5)
+    assert server.requests == 2
+    assert cache.stale_hits == 5
+    assert cache.get(url)[1] is True
+
+
+def test_concurrent_identical_fetches_share_requests(server):
+    coalescer = SingleFlight()
+    server.latency = 0.05
+    results = fetch([server.url + path for path in PATHS], coalescer=coalescer, copies=5)
+    assert server.requests == len(PATHS)
+    assert coalescer.stats() == {'calls': 15, 'saved': 12, 'in_flight': 0}
+    assert all(result == results[0] for result in results)
+
+
+def test_retryable_statuses_are_retried(server):
+    client = ApiClient(backoff=0.001)
+    server.errors = [503, 429]
+    (responses,) = fetch([server.url + PATHS[0]], client=client)
+    assert responses[0][0]['symbol'] == 'AAPL'
+    assert server.requests == 3
+    assert client.retries == 2
+
+
+def test_retries_give_up_after_max_retries(server):
+    client = ApiClient(backoff=0.001, max_retries=2)
+    server.errors = [500] * 3
+    with pytest.raises(ApiError):
+        fetch([server.url + PATHS[0]], client=client)
+    assert server.requests == 3
@@ -0,0 +1,37 @@
+import asyncio
+
+from http_client import ApiClient
+from stub_server import StubServer
+
+
+def test_processes_share_the_rate_limits():
+    client = ApiClient(rate_limits={'127.0.0.1': 8.0})
+    client.share(4)
+
+    async def bucket():
+        try:
+            return client._host_state('127.0.0.1')[2]
+        finally:
+            await client.close()
+
+    assert asyncio.run(bucket()).rate == 2.0
+
+
+def test_close_releases_the_sessions_of_earlier_loops():
+    client = ApiClient()
+    with StubServer() as server:
+        url = server.url + '/api/v3/quote/AAPL'
+        first = asyncio.new_event_loop()
+        try:
+            first.run_until_complete(client.get_json(url))
+        finally:
+            first.close()
+        (session,) = client._sessions.values()
+
+        async def fetch_and_close():
+            await client.get_json(url)
+            await client.close()
+
+        asyncio.run(fetch_and_close())
+    assert session.closed
+    assert client._sessions == {}
@@ -0,0 +1,59 @@
+import argparse
+
+import pytest
+
+from log_stats import IntervalAggregator, interval_minutes, stream_intervals
+
+
+def line(time, ip, path='/valuation/AAPL'):
+    return (f'10.0.0.1 - - [12/Jul/2025:{time} +0000] "GET {path} HTTP/1.1" 200 5 "-" "Mozilla/5.0" "{ip}"\n')
+
+
+# 1.1.1.1 goes on in the 09:05 interval after a line of the next one was written
+OUT_OF_ORDER = [
+    line('09:07:40', '1.1.1.1'),
+    line('09:07:42', '1.1.1.1'),
+    line('09:12:30', '2.2.2.2', '/'),
+    line('09:07:50', '1.1.1.1'),
+    line('09:07:59', '1.1.1.1'),
+]
+
+
+def test_out_of_order_lines_land_in_their_interval():
+    first, second = stream_intervals(OUT_OF_ORDER)
+    assert first.counts['total'] == 4
+    assert first.counts['/valuation'] == 4
+    assert first.top_ips() == [('1.1.1.1', 4, 2)]
+    assert second.top_ips() == [('2.2.2.2', 1, None)]
+
+
+def test_gap_is_measured_from_the_previous_line():
+    lines = [line('09:07:' + second, '1.1.1.1') for second in ('20', '40', '10', '12')]
+    (stats,) = stream_intervals(lines)
+    assert stats.top_ips() == [('1.1.1.1', 4, 2)]
+
+
+def test_lines_after_the_grace_period_are_counted_as_late():
+    aggregator = IntervalAggregator(grace=60)
+    intervals = list(stream_intervals(OUT_OF_ORDER, aggregator))
+    assert aggregator.late == 2
+    assert intervals[0].counts['total'] == 2
+
+
+def test_gap_is_taken_between_neighbours_in_time():
+    lines = [line('09:07:' + second, '1.1.1.1') for second in ('10', '40', '20')]
+    (stats,) = stream_intervals(lines)
+    assert stats.top_ips() == [('1.1.1.1', 3, 10)]
+
+
+def test_merged_parts_take_the_gap_between_neighbours_in_time():
+    lines = [line('09:07:' + second, '1.1.1.1') for second in ('10', '40', '31', '20')]
+    (first,) = stream_intervals(lines[:2])
+    (second,) = stream_intervals(lines[2:])
+    assert first.merge(second).top_ips() == [('1.1.1.1', 4, 9)]
+
+
+@pytest.mark.parametrize('text', ['0', '-5', 'five'])
+def test_interval_must_be_whole_positive_minutes(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        interval_minutes(text)
@@ -0,0 +1,33 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pipeline
+
+MODEL = """
+$.when(get_income_statement()).done(function(income){
+    _StopIfWatch(1, 'USD');
+});
+"""
+
+
+def failing_run(ticker, responses):
+    raise RuntimeError(f"model crashed on {ticker}")
+
+
+async def collect(**options):
+    with ThreadPoolExecutor(2) as executor:
+        results = pipeline.valuations(MODEL, ['AAA', 'BBB', 'CCC'], executor=executor, workers=2, **options)
+        return [result async for result in results]
+
+
+def test_executor_errors_become_results(monkeypatch):
+    async def fetch(urls):
+        return [[]]
+
+    monkeypatch.setattr(pipeline, 'fetch', fetch)
+    results = asyncio.run(asyncio.wait_for(collect(run=failing_run), timeout=10))
+    assert sorted(result['ticker'] for result in results) == ['AAA', 'BBB', 'CCC']
+    for result in results:
+        assert result['value'] is None
+        assert result['error'] == f"RuntimeError: model crashed on {result['ticker']}"
+        assert result['fetch_ms'] is not None
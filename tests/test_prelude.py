@@ -0,0 +1,67 @@
+import pytest
+
+from fixtures import CASH_FLOW_KEYS, INCOME_KEYS, statement
+from model_cache import ModelCache
+from prelude import get_prelude, install_native_helpers
+
+# (helper, JS expression) pairs, several per helper to cover the edge cases of the JS code
+CASES = [
+    ('addKey', "addKey('revenue', income, flows)"),
+    ('addKey', "addKey('revenue', income.slice(0, 5), flows)"),
+    ('addKey', "addKey('revenue', income.slice(3), flows)"),
+    ('addKey', "addKey('netIncome', income, flows)"),
+    ('addKey', "addKey('revenue', income, [])"),
+    ('linearRegressionGrowthRate', "linearRegressionGrowthRate('revenue', income, 5, 1)"),
+    ('linearRegressionGrowthRate', "linearRegressionGrowthRate('revenue', income, 2.5, 0.5)"),
+    ('linearRegressionGrowthRate', "linearRegressionGrowthRate('revenue', income.slice(0, 1), 5, 1)"),
+    ('linearRegressionGrowthRate', "linearRegressionGrowthRate('revenue', [], 3, 1)"),
+    ('linearRegressionGrowthRate', "linearRegressionGrowthRate('missing', income, 2)"),
+    ('averageGrowthRate', "averageGrowthRate('revenue', income)"),
+    ('averageGrowthRate', "averageGrowthRate('grossProfit', income)"),
+    ('averageGrowthRate', "averageGrowthRate('revenue', income.slice(0, 1))"),
+    ('averageMargin', "averageMargin('netIncome', 'revenue', income)"),
+    ('averageMargin', "averageMargin('netIncome', 'grossProfit', income)"),
+    ('averageMargin', "averageMargin('netIncome', 'revenue', [])"),
+    ('getGrowthList', "getGrowthList(income, 'revenue', 10, 0.05)"),
+    ('getGrowthList', "getGrowthList(income_ltm, 'revenue', 10, 0.05)"),
+    ('getGrowthList', "getGrowthList(income_ltm, 'revenue', 3, 1e300)"),
+    ('applyMarginToList', "applyMarginToList(linearRegressionGrowthRate('revenue', income, 5, 1), 0.2)"),
+    ('applyMarginToList', "applyMarginToList([1, 2, , 4], 0.5)"),
+    ('replaceWithLTM', "replaceWithLTM(income, income_ltm)"),
+]
+
+# numbers are serialized as strings so NaN/Infinity survive and nothing is rounded
+SNAPSHOT = """
+var _snapshot = JSON.stringify([_result, income, flows, income_ltm], function(key, value){
+    return typeof value == 'number' ? 'number:' + value : value;
+});
+"""
+
+
+def make_context(years):
+    income = statement(INCOME_KEYS, years=years)
+    # zero values exercise the JS division semantics
+    income[1]['revenue'] = 0
+    income[2]['grossProfit'] = 0
+    flows = statement(CASH_FLOW_KEYS, years=years, seed=1)[1:]
+    income_ltm = dict(income[0], date='LTM', revenue=income[0]['revenue'] * 1.1)
+    return {'income': income, 'flows': flows, 'income_ltm': income_ltm}
+
+
+def run(cache, native, source, years):
+    context = make_context(years)
+    if native:
+        install_native_helpers(context)
+    return cache.execute(get_prelude(native) + source, context)
+
+
+@pytest.fixture(scope='module')
+def cache():
+    return ModelCache()
+
+
+@pytest.mark.parametrize('years', [3, 20])
+@pytest.mark.parametrize('helper, expression', CASES)
+def test_native_helpers_match_js(cache, helper, expression, years):
+    source = 'var _result = ' + expression + ';' + SNAPSHOT
+    assert run(cache, True, source, years)._snapshot == run(cache, False, source, years)._snapshot
@@ -0,0 +1,33 @@
+import pytest
+
+from preprocessor import ModelSyntaxError, parse_model
+
+DONE = "\n$.when(get_quote()).done(function(quote){ _StopIfWatch(y, 'USD'); });"
+
+
+@pytest.mark.parametrize('statement', [
+    "var y = x++ / 2;",
+    "var y = x-- / 2 / 1;",
+    "var y = a[x++] / 2;",
+    "var y = x++/2, r = /a\\/b/g;",
+])
+def test_division_after_postfix_operators(statement):
+    source = "var x = 4; " + statement
+    assert parse_model(source + DONE).source.startswith(source)
+
+
+def test_unterminated_regex_is_still_an_error():
+    with pytest.raises(ModelSyntaxError):
+        parse_model("var r = (/abc;" + DONE)
+
+
+def test_repeated_sources_are_parsed_once():
+    source = "var x = 1, y = x;" + DONE
+    assert parse_model(source) is parse_model(source)
+
+
+def test_template_substitutions_stay_out_of_the_cache():
+    source = "var x = 1;" + DONE
+    model = parse_model(source)
+    parse_model("var s = `" + ''.join(f"${{x + {i}}}" for i in range(100)) + "`;" + DONE)
+    assert parse_model(source) is model
@@ -0,0 +1,49 @@
+import copy
+
+import pytest
+
+from model_cache import ModelCache
+from prelude import get_prelude, install_native_helpers
+from reports import shared_value
+from statements import decode_statement
+from test_prelude import CASES, SNAPSHOT, make_context
+
+MODES = ('converted', 'view', 'columns')
+
+# writes through every path a model has: assignment, delete, push, length and the helpers
+MUTATIONS = """
+income[0]['revenue'] = -1; delete income[1]['netIncome']; income[2].extra = {a: [1]}; income[2].extra.a.push(2);
+flows.push({date: 'new'}); flows.length = 3; flows.reverse(); income_ltm.date = 'changed';
+var _result = [replaceWithLTM(income, income_ltm), Object.keys(income[1]).length, income[2].extra.a.length,
+    averageMargin('netIncome', 'revenue', income), averageGrowthRate('revenue', income),
+    linearRegressionGrowthRate('grossProfit', income, 2, 1), averageGrowthRate('netIncome', flows)];
+"""
+
+
+def run(cache, native, source, context, mode):
+    if mode == 'columns':
+        context = {name: decode_statement(value) for name, value in context.items()}
+    if mode != 'converted':
+        context = {name: shared_value(value) for name, value in context.items()}
+    if native:
+        install_native_helpers(context)
+    return cache.execute(get_prelude(native) + source, context)
+
+
+@pytest.fixture(scope='module')
+def cache():
+    return ModelCache()
+
+
+@pytest.mark.parametrize('mode', MODES[1:])
+@pytest.mark.parametrize('native', [False, True])
+@pytest.mark.parametrize('source', [
+    'var _result = ' + expression + ';' + SNAPSHOT for _, expression in CASES
+] + [MUTATIONS + SNAPSHOT], ids=[expression for _, expression in CASES] + ['mutations'])
+def test_views_match_a_full_conversion(cache, source, native, mode):
+    expected = run(cache, native, source, make_context(20), 'converted')._snapshot
+    context = make_context(20)
+    original = copy.deepcopy(context)
+    assert run(cache, native, source, context, mode)._snapshot == expected
+    # the responses are shared with the other runs, a model never writes them
+    assert context == original
@@ -0,0 +1,70 @@
+import contextlib
+import io
+
+from fixtures import valuation_context
+from session import ValuationSession
+from statements import decode_statement
+
+# sets every global the prelude declares, but only when asked to
+SETTING_MODEL = """
+$.when(get_income_statement()).done(function(income){
+    if (_input_params.SET) {
+        Input({A: 1});
+        fillHistoricUsingList([], 'revenue', 2030);
+        _StopIfWatch(42, 'USD');
+    }
+});
+"""
+
+# reports what is left of the globals another run may have set
+READING_MODEL = """
+$.when(get_income_statement()).done(function(income){
+    var value = Object.keys(_input_global).length * 100 + dateToIndex(2020);
+    if (_input_params.SET) {
+        Input({B: 2, C: 3});
+        fillHistoricUsingList([], 'revenue', 2030);
+    }
+    _StopIfWatch(value, 'EUR');
+});
+"""
+
+# counts the inputs set before its own
+DEFAULTING_MODEL = """
+$.when(get_income_statement()).done(function(income){
+    var count = Object.keys(_input_global).length;
+    setInputDefault('G', 3);
+    _StopIfWatch(count, 'USD');
+});
+"""
+
+
+def session(raw_model):
+    responses = [decode_statement(valuation_context()['income'][0])]
+    return ValuationSession(raw_model, responses=responses)
+
+
+def evaluate(valuation_session, input_params=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return valuation_session.evaluate(input_params)
+
+
+def test_run_does_not_leak_globals_into_the_next():
+    valuation_session = session(SETTING_MODEL)
+    assert evaluate(valuation_session, {'SET': 1}) == {'value': 42, 'ccy': 'USD'}
+    assert evaluate(valuation_session) == evaluate(session(SETTING_MODEL)) == {'value': 0, 'ccy': ''}
+
+
+def test_models_in_a_row_match_fresh_sessions():
+    setting, reading = session(SETTING_MODEL), session(READING_MODEL)
+    expected = evaluate(session(READING_MODEL))
+    evaluate(setting, {'SET': 1})
+    evaluate(reading, {'SET': 1})
+    assert evaluate(reading) == expected
+    evaluate(setting, {'SET': 1})
+    assert evaluate(reading) == expected
+
+
+def test_prelude_objects_are_new_for_every_run():
+    valuation_session = session(DEFAULTING_MODEL)
+    assert evaluate(valuation_session) == {'value': 0, 'ccy': 'USD'}
+    assert evaluate(valuation_session) == {'value': 0, 'ccy': 'USD'}